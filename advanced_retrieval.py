@@ -3,10 +3,14 @@ Advanced Retrieval and Context Optimization for RAG System
 Implements re-ranking, diverse retrieval, and context optimization features.
 """
 
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
@@ -17,40 +21,296 @@ except ImportError:
     print("Warning: sentence-transformers not available. Some features will be limited.")
     SENTENCE_TRANSFORMERS_AVAILABLE = False
 
+try:
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    ONNX_RUNTIME_AVAILABLE = True
+except ImportError:
+    ONNX_RUNTIME_AVAILABLE = False
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+CROSS_ENCODER_MODEL_NAME = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+# 'torch' is the fp32 reference; 'int8' applies dynamic quantization; 'onnx' uses ONNX Runtime
+INFERENCE_BACKENDS = ('torch', 'int8', 'onnx')
+
+# Probe pairs for comparing a backend's scores against the fp32 reference
+PARITY_PROBE_PAIRS = [
+    ["who published on deep learning", "Dr. Sandhya Banda published Advanced Deep Learning for Healthcare in IEEE Transactions on Medical Imaging."],
+    ["who published on deep learning", "The IoT based smart grid project is funded by SERB."],
+    ["who published on deep learning", "Convolutional neural networks are a family of deep learning models for images."],
+    ["smart grid patent", "Smart Energy Management System patent filed by Dr. Priya Sharma and Dr. Mohan Rao."],
+    ["smart grid patent", "The department library is open from 9 am to 5 pm on weekdays."],
+    ["smart grid patent", "IoT Based Smart Grid System, an ongoing research project in the ECE department."],
+    ["medical image analysis funding", "Deep Learning for Medical Image Analysis received 50 lakh rupees from DST."],
+    ["medical image analysis funding", "Students must register for the semester examinations before the deadline."],
+]
+
+class RerankScheduler:
+    """Micro-batches cross-encoder scoring from concurrent requests onto one inference worker."""
+
+    def __init__(self, score_fn: Callable[[List[List[str]]], List[float]],
+                 max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        """
+        Initialize the scheduler and start its worker thread.
+
+        Args:
+            score_fn: Scores a list of (query, text) pairs in one forward pass
+            max_batch_size: Maximum pairs per batched forward pass
+            max_wait_ms: Maximum time to wait for more requests before running a batch
+        """
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="rerank-worker", daemon=True)
+        self._worker.start()
+
+    def score(self, pairs: List[List[str]], timeout: Optional[float] = None) -> List[float]:
+        """
+        Score pairs, sharing a forward pass with other in-flight requests.
+
+        Args:
+            pairs: List of [query, text] pairs
+            timeout: Seconds to wait for the scores before giving up
+
+        Returns:
+            One score per pair, in input order
+        """
+        future: Future = Future()
+        self._queue.put((pairs, future))
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            # Still queued: the worker skips it. Already in a batch: its scores are discarded.
+            future.cancel()
+            raise
+
+    def _run(self):
+        """Collect pending requests into batches and scatter the scores back."""
+        while True:
+            batch = [self._queue.get()]
+            batch_size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+
+            while batch_size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                batch_size += len(item[0])
+
+            # Drop requests whose caller gave up while they were queued
+            batch = [(pairs, future) for pairs, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            all_pairs = [pair for pairs, _ in batch for pair in pairs]
+            try:
+                scores = self.score_fn(all_pairs)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for pairs, future in batch:
+                future.set_result(scores[offset:offset + len(pairs)])
+                offset += len(pairs)
+
 class AdvancedRetriever:
     """Advanced retrieval system with re-ranking and diverse retrieval."""
 
-    def __init__(self):
+    def __init__(self, rerank_batch_size: int = 64, rerank_max_wait_ms: float = 5.0,
+                 backend: str = 'torch', parity_check: bool = False):
+        """
+        Initialize the retriever.
+
+        Args:
+            rerank_batch_size: Maximum pairs per batched rerank pass (0 disables batching)
+            rerank_max_wait_ms: Maximum wait for more rerank requests before running a batch
+            backend: Inference backend, one of INFERENCE_BACKENDS
+            parity_check: Compare a non-fp32 backend against fp32 scores at load time
+        """
         self.embedding_model = None
         self.cross_encoder = None
+        self.rerank_scheduler = None
+        self.rerank_batch_size = rerank_batch_size
+        self.rerank_max_wait_ms = rerank_max_wait_ms
+        self.backend = backend if backend in INFERENCE_BACKENDS else 'torch'
+        self.parity_check = parity_check
         self._load_models()
 
     def _load_models(self):
         """Load embedding and cross-encoder models."""
-        if SENTENCE_TRANSFORMERS_AVAILABLE:
+        if self.backend == 'onnx' and not ONNX_RUNTIME_AVAILABLE:
+            print("Warning: optimum[onnxruntime] not available, using the torch backend")
+            self.backend = 'torch'
+
+        if self.backend != 'torch':
+            # Any failure of the optional backend (missing extras, an older sentence-transformers
+            # without backend=, a failed export) falls back to fp32 rather than disabling models
             try:
-                # Load sentence transformer for embeddings
-                self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+                if SENTENCE_TRANSFORMERS_AVAILABLE:
+                    self.embedding_model = self._load_embedding_model(self.backend)
+                self.cross_encoder, self.cross_encoder_tokenizer = self._load_cross_encoder(self.backend)
             except Exception as e:
-                print(f"Warning: Could not load embedding model: {e}")
+                print(f"Warning: Could not load models with the '{self.backend}' backend, "
+                      f"using the fp32 torch backend: {e}")
+                self.backend = 'torch'
                 self.embedding_model = None
-        else:
-            print("Sentence transformers not available, using fallback methods")
-            self.embedding_model = None
+                self.cross_encoder = None
 
-        try:
-            # Load cross-encoder for re-ranking
-            self.cross_encoder = AutoModelForSequenceClassification.from_pretrained(
-                'cross-encoder/ms-marco-MiniLM-L-6-v2'
+        if self.backend == 'torch':
+            if SENTENCE_TRANSFORMERS_AVAILABLE:
+                try:
+                    # Load sentence transformer for embeddings
+                    self.embedding_model = self._load_embedding_model('torch')
+                except Exception as e:
+                    print(f"Warning: Could not load embedding model: {e}")
+                    self.embedding_model = None
+            else:
+                print("Sentence transformers not available, using fallback methods")
+                self.embedding_model = None
+
+            try:
+                # Load cross-encoder for re-ranking
+                self.cross_encoder, self.cross_encoder_tokenizer = self._load_cross_encoder('torch')
+            except Exception as e:
+                print(f"Warning: Could not load cross-encoder: {e}")
+                self.cross_encoder = None
+
+        if self.backend != 'torch' and self.parity_check and self.cross_encoder:
+            report = self.check_backend_parity()
+            print(f"Inference backend '{self.backend}' parity: {report}")
+            if not report['passed']:
+                print("Warning: Backend parity check failed, reverting to the fp32 torch backend")
+                self.backend = 'torch'
+                self.embedding_model = self._load_embedding_model('torch') if self.embedding_model else None
+                self.cross_encoder, self.cross_encoder_tokenizer = self._load_cross_encoder('torch')
+
+        # Batch rerank requests across concurrent queries
+        if self.cross_encoder and self.rerank_batch_size > 0:
+            self.rerank_scheduler = RerankScheduler(
+                self._score_pairs,
+                max_batch_size=self.rerank_batch_size,
+                max_wait_ms=self.rerank_max_wait_ms
             )
-            self.cross_encoder_tokenizer = AutoTokenizer.from_pretrained(
-                'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+    def _load_embedding_model(self, backend: str):
+        """Load the sentence transformer for the given inference backend."""
+        if backend == 'onnx':
+            return SentenceTransformer(EMBEDDING_MODEL_NAME, backend='onnx')
+
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+        if backend == 'int8':
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+
+    def _load_cross_encoder(self, backend: str):
+        """Load the cross-encoder and its tokenizer for the given inference backend."""
+        tokenizer = AutoTokenizer.from_pretrained(CROSS_ENCODER_MODEL_NAME)
+        if backend == 'onnx':
+            model = ORTModelForSequenceClassification.from_pretrained(CROSS_ENCODER_MODEL_NAME, export=True)
+            return model, tokenizer
+
+        model = AutoModelForSequenceClassification.from_pretrained(CROSS_ENCODER_MODEL_NAME)
+        model.eval()
+        if backend == 'int8':
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model, tokenizer
+
+    def _score_pairs(self, pairs: List[List[str]], model=None, tokenizer=None) -> List[float]:
+        """Run one cross-encoder forward pass over (query, text) pairs."""
+        model = model or self.cross_encoder
+        tokenizer = tokenizer or self.cross_encoder_tokenizer
+        inputs = tokenizer(
+            pairs, return_tensors='pt', padding=True, truncation=True, max_length=512
+        )
+
+        with torch.no_grad():
+            scores = model(**inputs).logits.view(-1)
+
+        return scores.tolist()
+
+    def _score_pairs_until(self, pairs: List[List[str]], timeout: Optional[float],
+                           slice_size: int = 8) -> List[float]:
+        """
+        Score pairs without the batching worker, stopping once timeout seconds have passed.
+        A forward pass cannot be interrupted, so pairs are scored in small slices and the
+        deadline is checked between them; the result may cover only a prefix of pairs.
+        """
+        if timeout is None:
+            return self._score_pairs(pairs)
+        deadline = time.monotonic() + timeout
+        scores: List[float] = []
+        for start in range(0, len(pairs), slice_size):
+            if time.monotonic() >= deadline:
+                break
+            scores.extend(self._score_pairs(pairs[start:start + slice_size]))
+        return scores
+
+    def check_backend_parity(self, pairs: Optional[List[List[str]]] = None,
+                             min_rank_correlation: float = 0.95,
+                             min_embedding_cosine: float = 0.98) -> Dict[str, Any]:
+        """
+        Compare the active backend against the fp32 torch models.
+
+        Args:
+            pairs: (query, text) pairs to score; defaults to PARITY_PROBE_PAIRS
+            min_rank_correlation: Minimum Spearman correlation of rerank scores
+            min_embedding_cosine: Minimum cosine between backend and fp32 embeddings
+
+        Returns:
+            Parity report with score deviation, rank correlation and embedding cosine
+        """
+        pairs = pairs or PARITY_PROBE_PAIRS
+
+        ref_model, ref_tokenizer = self._load_cross_encoder('torch')
+        ref_scores = np.array(self._score_pairs(pairs, ref_model, ref_tokenizer))
+        scores = np.array(self._score_pairs(pairs))
+        ref_ranks = np.argsort(np.argsort(ref_scores))
+        ranks = np.argsort(np.argsort(scores))
+        rank_correlation = float(np.corrcoef(ref_ranks, ranks)[0, 1])
+
+        report = {
+            'backend': self.backend,
+            'max_score_diff': float(np.max(np.abs(ref_scores - scores))),
+            'rank_correlation': rank_correlation,
+            'passed': rank_correlation >= min_rank_correlation
+        }
+
+        if self.embedding_model:
+            texts = [text for _, text in pairs]
+            ref_embeddings = self._load_embedding_model('torch').encode(
+                texts, convert_to_numpy=True, normalize_embeddings=True
             )
-        except Exception as e:
-            print(f"Warning: Could not load cross-encoder: {e}")
-            self.cross_encoder = None
+            embeddings = self.embedding_model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+            min_cosine = float(np.min(np.sum(ref_embeddings * embeddings, axis=1)))
+            report['min_embedding_cosine'] = min_cosine
+            report['passed'] = report['passed'] and min_cosine >= min_embedding_cosine
+
+        return report
+
+    def embed_query(self, query: str) -> Optional[np.ndarray]:
+        """
+        Embed a query as an L2-normalized vector.
+
+        Args:
+            query: Search query
 
-    def rerank_chunks(self, query: str, chunks: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
+        Returns:
+            Normalized embedding, or None if no embedding model is loaded
+        """
+        if not self.embedding_model:
+            return None
+        return self.embedding_model.encode(query, convert_to_numpy=True, normalize_embeddings=True)
+
+    def rerank_chunks(self, query: str, chunks: List[Dict[str, Any]], top_k: int = 5,
+                      timeout: Optional[float] = None) -> List[Dict[str, Any]]:
         """
         Re-rank chunks using cross-encoder for better relevance.
 
@@ -58,9 +318,11 @@ class AdvancedRetriever:
             query: Search query
             chunks: List of chunk dictionaries
             top_k: Number of top chunks to return
+            timeout: Seconds to spend scoring; batched scores that arrive later are dropped
+                and the input order kept, unbatched scoring stops after the slice in progress
 
         Returns:
-            Re-ranked chunks
+            Re-ranked chunks (chunks left unscored follow the scored ones in input order)
         """
         if not self.cross_encoder or not chunks:
             return chunks[:top_k]
@@ -70,18 +332,24 @@ class AdvancedRetriever:
             pairs = [[query, chunk['chunk_text']] for chunk in chunks]
 
             # Get cross-encoder scores
-            inputs = self.cross_encoder_tokenizer(
-                pairs, return_tensors='pt', padding=True, truncation=True, max_length=512
-            )
+            if self.rerank_scheduler:
+                scores = self.rerank_scheduler.score(pairs, timeout=timeout)
+            else:
+                scores = self._score_pairs_until(pairs, timeout)
 
-            with torch.no_grad():
-                scores = self.cross_encoder(**inputs).logits.squeeze()
+            # Keep the score so later stages can use actual query relevance
+            for chunk, score in zip(chunks, scores):
+                chunk['rerank_score'] = score
 
             # Sort chunks by scores
-            scored_chunks = list(zip(chunks, scores.tolist() if hasattr(scores, 'tolist') else scores))
+            scored_chunks = list(zip(chunks, scores))
             scored_chunks.sort(key=lambda x: x[1], reverse=True)
 
-            return [chunk for chunk, score in scored_chunks[:top_k]]
+            ranked = [chunk for chunk, score in scored_chunks] + chunks[len(scores):]
+            return ranked[:top_k]
+
+        except FuturesTimeoutError:
+            return chunks[:top_k]
 
         except Exception as e:
             print(f"Warning: Cross-encoder re-ranking failed: {e}")
@@ -92,6 +360,9 @@ class AdvancedRetriever:
         """
         Select diverse chunks to avoid redundancy.
 
+        Uses embeddings already attached to the chunks (fetched from ChromaDB)
+        and only encodes text when they are missing.
+
         Args:
             chunks: List of chunk dictionaries
             max_chunks: Maximum number of chunks to return
@@ -100,61 +371,72 @@ class AdvancedRetriever:
         Returns:
             Diverse chunk selection
         """
-        if not self.embedding_model or len(chunks) <= max_chunks:
+        if len(chunks) <= max_chunks:
             return chunks[:max_chunks]
 
         try:
-            # Get embeddings for chunks
-            texts = [chunk['chunk_text'] for chunk in chunks]
-            embeddings = self.embedding_model.encode(texts, convert_to_numpy=True)
-
-            # Select diverse chunks using Maximal Marginal Relevance (MMR)
-            selected_indices = []
-            remaining_indices = list(range(len(chunks)))
-
-            # Start with the highest quality chunk
-            best_idx = max(remaining_indices, key=lambda i: chunks[i].get('quality_score', 0))
-            selected_indices.append(best_idx)
-            remaining_indices.remove(best_idx)
-
-            while len(selected_indices) < max_chunks and remaining_indices:
-                best_score = -1
-                best_idx = None
-
-                for idx in remaining_indices:
-                    # Calculate relevance score (quality + recency bonus)
-                    relevance = chunks[idx].get('quality_score', 0.5)
-
-                    # Calculate diversity score (minimum similarity to selected chunks)
-                    similarities = []
-                    for selected_idx in selected_indices:
-                        sim = cosine_similarity(
-                            embeddings[idx].reshape(1, -1),
-                            embeddings[selected_idx].reshape(1, -1)
-                        )[0][0]
-                        similarities.append(sim)
-
-                    diversity = 1 - max(similarities) if similarities else 1.0
-
-                    # MMR score
-                    mmr_score = 0.5 * relevance + 0.5 * diversity
-
-                    if mmr_score > best_score:
-                        best_score = mmr_score
-                        best_idx = idx
-
-                if best_idx is not None:
-                    selected_indices.append(best_idx)
-                    remaining_indices.remove(best_idx)
-                else:
-                    break
+            embeddings = self._chunk_embeddings(chunks)
+            if embeddings is None:
+                return chunks[:max_chunks]
 
+            selected_indices = self._mmr_select(embeddings, self._chunk_relevance(chunks), max_chunks)
             return [chunks[i] for i in selected_indices]
 
         except Exception as e:
             print(f"Warning: Diverse retrieval failed: {e}")
             return chunks[:max_chunks]
 
+    def _chunk_embeddings(self, chunks: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Return chunk embeddings, reusing stored vectors when every chunk carries one."""
+        if all(chunk.get('embedding') is not None for chunk in chunks):
+            return np.asarray([chunk['embedding'] for chunk in chunks], dtype=np.float32)
+        if not self.embedding_model:
+            return None
+        texts = [chunk['chunk_text'] for chunk in chunks]
+        return self.embedding_model.encode(texts, convert_to_numpy=True)
+
+    def _chunk_relevance(self, chunks: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        Query relevance per chunk scaled to [0, 1].
+
+        Prefers cross-encoder scores, then vector distance, then quality score.
+        """
+        if all('rerank_score' in chunk for chunk in chunks):
+            scores = np.array([chunk['rerank_score'] for chunk in chunks], dtype=np.float32)
+        elif all('distance' in chunk for chunk in chunks):
+            scores = -np.array([chunk['distance'] for chunk in chunks], dtype=np.float32)
+        else:
+            return np.array([chunk.get('quality_score', 0.5) for chunk in chunks], dtype=np.float32)
+
+        spread = scores.max() - scores.min()
+        if spread <= 0:
+            return np.ones(len(chunks), dtype=np.float32)
+        return (scores - scores.min()) / spread
+
+    def _mmr_select(self, embeddings: np.ndarray, relevance: np.ndarray, max_chunks: int) -> List[int]:
+        """Vectorized Maximal Marginal Relevance over a precomputed similarity matrix."""
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        normalized = embeddings / np.maximum(norms, 1e-12)
+        similarity = normalized @ normalized.T
+
+        # Start with the most relevant chunk
+        first = int(np.argmax(relevance))
+        selected_indices = [first]
+        available = np.ones(len(relevance), dtype=bool)
+        available[first] = False
+        max_similarity = similarity[first].copy()
+
+        while len(selected_indices) < max_chunks and available.any():
+            # MMR score: relevance balanced against similarity to the closest selected chunk
+            mmr_scores = 0.5 * relevance + 0.5 * (1 - max_similarity)
+            mmr_scores[~available] = -np.inf
+            best_idx = int(np.argmax(mmr_scores))
+            selected_indices.append(best_idx)
+            available[best_idx] = False
+            np.maximum(max_similarity, similarity[best_idx], out=max_similarity)
+
+        return selected_indices
+
     def dynamic_context_window(self, query: str, base_window: int = 3000) -> int:
         """
         Determine optimal context window based on query complexity.
@@ -192,8 +474,9 @@ class AdvancedRetriever:
 class ContextOptimizer:
     """Context optimization with compression and prioritization."""
 
-    def __init__(self):
-        self.retriever = AdvancedRetriever()
+    def __init__(self, retriever: Optional[AdvancedRetriever] = None):
+        # Share the retriever's models instead of loading a second copy
+        self.retriever = retriever or AdvancedRetriever()
 
     def compress_context(self, chunks: List[Dict[str, Any]], max_tokens: int = 2000) -> str:
         """
@@ -292,5 +575,10 @@ class ContextOptimizer:
         return sorted(chunks, key=lambda x: x.get('priority_score', 0), reverse=True)
 
 # Global instances
-retriever = AdvancedRetriever()
-context_optimizer = ContextOptimizer()
+retriever = AdvancedRetriever(
+    rerank_batch_size=int(os.getenv("RERANK_BATCH_SIZE", "64")),
+    rerank_max_wait_ms=float(os.getenv("RERANK_MAX_WAIT_MS", "5")),
+    backend=os.getenv("RETRIEVER_BACKEND", "torch").lower(),
+    parity_check=os.getenv("RETRIEVER_PARITY_CHECK", "1") == "1"
+)
+context_optimizer = ContextOptimizer(retriever)
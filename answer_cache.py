@@ -0,0 +1,100 @@
+"""
+Semantic Answer Cache for RAG System
+Serves answers to near-identical queries from memory by matching query
+embeddings, invalidated whenever the indexed corpus changes.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+class SemanticAnswerCache:
+    """Bounded LRU/TTL cache keyed by query embedding and corpus version."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600.0,
+                 similarity_threshold: float = 0.95):
+        """
+        Initialize the answer cache.
+
+        Args:
+            max_entries: Maximum cached answers before LRU eviction
+            ttl_seconds: Lifetime of a cached answer in seconds
+            similarity_threshold: Minimum cosine similarity for a cache hit
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.corpus_version = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bump_version(self) -> int:
+        """Invalidate all cached answers after the corpus changes."""
+        with self._lock:
+            self.corpus_version += 1
+            self._entries.clear()
+            return self.corpus_version
+
+    def get(self, embedding: np.ndarray, scope: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached answer for a query embedding.
+
+        Args:
+            embedding: L2-normalized query embedding
+            scope: Key of the retrieval filters the answer must have been computed under
+
+        Returns:
+            Cached result dictionary, or None on a miss
+        """
+        with self._lock:
+            self._evict_expired()
+            keys = [k for k, v in self._entries.items() if v['scope'] == scope]
+            if not keys:
+                return None
+
+            matrix = np.vstack([self._entries[k]['embedding'] for k in keys])
+            similarities = matrix @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+
+            key = keys[best]
+            self._entries.move_to_end(key)
+            return self._entries[key]['result']
+
+    def put(self, query: str, embedding: np.ndarray, result: Dict[str, Any],
+            corpus_version: int, scope: str = ""):
+        """
+        Store an answer computed against a given corpus version.
+
+        Args:
+            query: Normalized query text
+            embedding: L2-normalized query embedding
+            result: Response payload to cache
+            corpus_version: Corpus version the answer was computed against
+            scope: Key of the retrieval filters the answer was computed under
+        """
+        with self._lock:
+            # Drop answers computed before an upload or delete landed
+            if corpus_version != self.corpus_version:
+                return
+            key = f"{scope}|{query}"
+            self._entries[key] = {
+                'embedding': embedding,
+                'result': result,
+                'scope': scope,
+                'expires_at': time.monotonic() + self.ttl_seconds
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _evict_expired(self):
+        """Remove entries whose TTL has elapsed."""
+        now = time.monotonic()
+        expired = [k for k, v in self._entries.items() if v['expires_at'] <= now]
+        for key in expired:
+            del self._entries[key]
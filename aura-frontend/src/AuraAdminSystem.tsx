@@ -133,7 +133,23 @@ const AURACompleteSystem = () => {
       });
       const data = await res.json();
       if (res.ok) {
-        alert("Document indexed successfully!");
+        // Indexing runs in the background; poll the job until it finishes
+        let job = data;
+        while (data.job_id && job.status !== 'completed' && job.status !== 'failed') {
+          await new Promise(resolve => setTimeout(resolve, 1500));
+          const jobRes = await fetch(`${backendUrl}/api/jobs/${data.job_id}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+          });
+          if (!jobRes.ok) break;
+          job = await jobRes.json();
+        }
+        if (job.status === 'failed') {
+          alert(`Indexing failed: ${job.error}`);
+        } else if (data.deduplicated) {
+          alert(`Identical content is already indexed as "${data.duplicate_of.filename}". Linked without re-indexing.`);
+        } else {
+          alert("Document indexed successfully!");
+        }
         fetchDocuments();
       } else {
         alert(`Upload failed: ${data.detail || res.statusText}`);
@@ -174,10 +190,11 @@ const AURACompleteSystem = () => {
 
     try {
       const token = sessionStorage.getItem('aura_token');
-      const res = await fetch(`${backendUrl}/api/query`, {
+      const res = await fetch(`${backendUrl}/api/query/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
           'Authorization': `Bearer ${token}`
         },
         body: JSON.stringify({
@@ -187,19 +204,40 @@ const AURACompleteSystem = () => {
         })
       });
 
-      if (!res.ok) {
+      if (!res.ok || !res.body) {
         if (res.status === 401) {
           throw new Error("Unauthorized: Your session may have expired. Please log in again.");
         }
         throw new Error(`API error: ${res.statusText} (${res.status})`);
       }
 
-      const data = await res.json();
-      setMessages(prev => [...prev, {
-        role: 'assistant',
-        content: data.answer,
-        sources: data.sources
-      }]);
+      // Render the answer progressively as server-sent events arrive
+      setMessages(prev => [...prev, { role: 'assistant', content: '', sources: [] }]);
+      const updateAnswer = (update: (m: Message) => Message) => {
+        setMessages(prev => [...prev.slice(0, -1), update(prev[prev.length - 1])]);
+      };
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split('\n\n');
+        buffer = frames.pop() || '';
+        for (const frame of frames) {
+          const event = frame.match(/^event: (.*)$/m)?.[1];
+          const data = frame.match(/^data: (.*)$/m)?.[1];
+          if (!event || !data) continue;
+          const payload = JSON.parse(data);
+          if (event === 'sources') {
+            updateAnswer(m => ({ ...m, sources: payload.sources }));
+          } else if (event === 'token') {
+            updateAnswer(m => ({ ...m, content: m.content + payload.text }));
+          }
+        }
+      }
     } catch (err: any) {
       setMessages(prev => [...prev, {
         role: 'assistant',
@@ -393,7 +431,7 @@ const AURACompleteSystem = () => {
                 </div>
               </div>
             ))}
-            {loading && (
+            {loading && messages[messages.length - 1]?.role !== 'assistant' && (
               <div className="flex justify-start">
                 <div className="bg-slate-50 p-4 rounded-3xl border border-slate-100 flex items-center gap-3">
                   <Loader2 className="w-4 h-4 animate-spin text-indigo-600" />
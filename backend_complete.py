@@ -7,7 +7,11 @@ import time
 import json
 import re
 import subprocess
-from typing import List, Optional, Dict, Any, Generator
+import hashlib
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Dict, Any, Generator, AsyncIterator, Tuple
 from datetime import datetime, timedelta, timezone
 from contextlib import contextmanager
 if sys.platform == "win32":
@@ -16,7 +20,7 @@ if sys.platform == "win32":
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, status, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 import psycopg
 from psycopg.rows import dict_row
@@ -29,22 +33,37 @@ except ImportError:
     logging.warning("google.generativeai module not found. Gemini LLM will not be available.")
 import aiofiles
 import httpx
-from openpyxl import load_workbook
-import PyPDF2
-import docx
+from llm_client import AsyncLLMClient
+from answer_cache import SemanticAnswerCache
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from publication_index import PublicationIndex, is_publication_sheet
+from latency_budget import LatencyBudget
+from single_flight import SingleFlight
+from embedding_cache import EmbeddingCache, BatchEmbedder
+from near_duplicates import MinHashLSH, dedup_scope
+from keyword_index import KeywordIndex, text_terms
+from document_ingestion import (IngestionJobStore, extract_and_chunk, init_extraction_worker,
+                                CHUNK_LEVEL_NAMES, INGEST_CHUNK_LEVELS)
+from index_lock import IndexLock
 
 # --- Globals for lazily loaded modules ---
 create_semantic_chunks = None
 retriever = None
 context_optimizer = None
 collection = None
+lexical_index = None
+embedder = None
+ingest_pool = None
+embed_executor = None
+ingest_queue = None
+ingest_workers = []
 
 def initialize_services():
     """
     Initializes all slow, blocking services in a separate thread.
     This includes NLTK, sentence-transformers, and ChromaDB.
     """
-    global create_semantic_chunks, retriever, context_optimizer, collection
+    global create_semantic_chunks, retriever, context_optimizer, collection, lexical_index, embedder, keywords_ranked
     logger.debug("Initializing background services...")
 
     # 1. Initialize NLTK and chunking utils
@@ -84,7 +103,55 @@ def initialize_services():
     except Exception as e:
         logger.error(f"ChromaDB initialization failed: {e}")
 
-    # 4. Check LLM Health
+    # 3.1. Embed chunks explicitly with the retriever's model, through the on-disk cache
+    if collection:
+        try:
+            embedder = create_embedder(retriever)
+        except Exception as e:
+            logger.error(f"Embedding cache initialization failed: {e}")
+
+    # 4. Load the BM25 lexical index, backfilling it from an existing collection
+    if collection:
+        try:
+            lexical_index = BM25Index(LEXICAL_INDEX_PATH)
+            if not len(lexical_index) and collection.count():
+                logger.info("Building BM25 index from existing ChromaDB collection...")
+                lexical_index.rebuild_from_collection(collection)
+        except Exception as e:
+            logger.error(f"BM25 index initialization failed: {e}")
+
+    # 4.1. Sign existing chunks so new uploads are deduplicated against them
+    if collection and not len(near_duplicate_index) and collection.count():
+        try:
+            logger.info("Building near-duplicate index from existing ChromaDB collection...")
+            near_duplicate_index.rebuild_from_collection(collection)
+        except Exception as e:
+            logger.error(f"Near-duplicate index initialization failed: {e}")
+
+    # 4.2. Count term document frequencies of existing chunks for TF-IDF keywords
+    if collection and not len(keyword_index) and collection.count():
+        try:
+            logger.info("Building keyword statistics from existing ChromaDB collection...")
+            keyword_index.rebuild_from_collection(collection)
+        except Exception as e:
+            logger.error(f"Keyword index initialization failed: {e}")
+
+    # 4.3. Re-rank keywords of chunks stored before TF-IDF ranking, so the prefilter can trust them
+    if collection:
+        try:
+            keywords_ranked = rerank_stored_keywords(collection)
+        except Exception as e:
+            logger.error(f"Keyword re-ranking failed; keyword prefilter disabled: {e}")
+
+    # 5. Index journal spreadsheets uploaded before the publication index existed
+    if not os.path.exists(PUBLICATION_INDEX_PATH):
+        try:
+            publication_index.rebuild_from_directory(UPLOAD_DIR)
+            logger.debug(f"Publication index built with {len(publication_index)} dated rows.")
+        except Exception as e:
+            logger.error(f"Publication index initialization failed: {e}")
+
+    # 6. Check LLM Health
     logger.debug("Checking LLM health...")
     if not check_llm_health():
         logger.warning("LLM Health Check Failed during startup. Check configuration.")
@@ -115,11 +182,95 @@ if GEMINI_API_KEY and genai:
     genai.configure(api_key=GEMINI_API_KEY)
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "ollama") # or 'ollama'
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+
+llm_client = AsyncLLMClient(
+    provider=LLM_PROVIDER,
+    ollama_url=OLLAMA_URL,
+    ollama_model=OLLAMA_MODEL,
+    timeout=LLM_TIMEOUT,
+    max_connections=LLM_MAX_CONNECTIONS,
+    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+)
+
+# Answer Cache Config
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+answer_cache = SemanticAnswerCache(
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl_seconds=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_THRESHOLD,
+)
+
+# Coalesces identical concurrent /api/query requests onto one pipeline run
+query_flight = SingleFlight()
+
+# Retrieval Config
+SUMMARY_QUERY_PATTERN = re.compile(r"\b(summar\w*|overview|outline|in brief|main points|key findings)\b", re.IGNORECASE)
+VECTOR_CANDIDATES = int(os.getenv("VECTOR_CANDIDATES", "20"))
+LEXICAL_CANDIDATES = int(os.getenv("LEXICAL_CANDIDATES", "20"))
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "12"))
+RERANK_REDUCED_CANDIDATES = int(os.getenv("RERANK_REDUCED_CANDIDATES", "5"))
+# Candidates are narrowed to chunks whose keywords include a rare query term, if enough remain
+KEYWORD_PREFILTER_MAX_DF = float(os.getenv("KEYWORD_PREFILTER_MAX_DF", "0.05"))
+KEYWORD_PREFILTER_MIN_CANDIDATES = int(os.getenv("KEYWORD_PREFILTER_MIN_CANDIDATES", "4"))
+# Set once every stored chunk carries TF-IDF keywords; until then the prefilter is off
+keywords_ranked = False
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+
+# Latency Budget Config (stage deadlines are measured from the start of the request)
+QUERY_BUDGET_MS = float(os.getenv("QUERY_BUDGET_MS", "60000"))
+STAGE_DEADLINES_MS = {
+    "retrieval": float(os.getenv("RETRIEVAL_DEADLINE_MS", "1500")),
+    "rerank": float(os.getenv("RERANK_DEADLINE_MS", "3000")),
+    "mmr": float(os.getenv("MMR_DEADLINE_MS", "3500")),
+}
 
 # Paths
 UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 CHROMA_DB_DIR = os.path.join(os.getcwd(), "chroma_db")
+LEXICAL_INDEX_PATH = os.path.join(os.getcwd(), "bm25_index.pkl")
+EMBEDDING_CACHE_PATH = os.path.join(os.getcwd(), "embedding_cache.sqlite")
+NEAR_DUPLICATE_INDEX_PATH = os.path.join(os.getcwd(), "near_duplicates.pkl")
+KEYWORD_INDEX_PATH = os.path.join(os.getcwd(), "keyword_index.pkl")
+PUBLICATION_INDEX_PATH = os.path.join(os.getcwd(), "publication_index.json")
+
+publication_index = PublicationIndex(PUBLICATION_INDEX_PATH)
+
+# Corpus-wide near-duplicate chunk detection (MinHash signatures, LSH bands x rows)
+near_duplicate_index = MinHashLSH(
+    bands=int(os.getenv("NEAR_DUP_BANDS", "16")),
+    rows=int(os.getenv("NEAR_DUP_ROWS", "8")),
+    threshold=float(os.getenv("NEAR_DUP_THRESHOLD", "0.85")),
+    path=NEAR_DUPLICATE_INDEX_PATH
+)
+
+# Corpus-wide term document frequencies for TF-IDF chunk keywords
+keyword_index = KeywordIndex(KEYWORD_INDEX_PATH)
+
+# Ingestion Config (uploads are queued on disk and processed in the background)
+INGEST_JOBS_DIR = os.path.join(os.getcwd(), "ingest_jobs")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(min(4, os.cpu_count() or 1))))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# How often a duplicate of a still-ingesting upload checks whether it can link to it
+DUPLICATE_WAIT_SECONDS = 2.0
+# Room for multipart boundaries and the department/category form fields around the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+ingestion_jobs = IngestionJobStore(INGEST_JOBS_DIR)
+
+# Held for the server's lifetime so bulk_ingest cannot rewrite the index files underneath it
+index_lock = IndexLock()
 
 # Skip Embeddings Flag (for debugging)
 SKIP_EMBEDDINGS = os.getenv("SKIP_EMBEDDINGS", "0") == "1"
@@ -200,7 +351,7 @@ def check_llm_health():
     if LLM_PROVIDER.lower() == "ollama":
         try:
             # Check local ollama
-            response = httpx.get("http://localhost:11434/api/tags")
+            response = httpx.get(llm_client.ollama_tags_url)
             return response.status_code == 200
         except:
             return False
@@ -216,15 +367,7 @@ def check_llm_health():
             logger.error(f"Gemini Health Check Failed: {e}")
             return False
 
-def generate_answer_with_llm(context: str, query: str, history: List[Dict[str, str]] = None) -> str:
-    if not create_semantic_chunks:
-        # Services are not loaded yet
-        return "The system is still initializing. Please try again in a moment."
-
-    if not context or not context.strip():
-        # If context is empty, provide a direct, helpful response instead of asking for clarification.
-        return "I could not find any information about that in the uploaded documents. Please ensure the relevant document has been uploaded and processed correctly."
-
+def build_llm_prompt(context: str, query: str, history: List[Dict[str, str]] = None) -> str:
     history_str = ""
     if history:
         for msg in history:
@@ -257,132 +400,653 @@ def generate_answer_with_llm(context: str, query: str, history: List[Dict[str, s
 
     Answer:
     """
+    return system_prompt
+
+async def generate_answer_with_llm(context: str, query: str, history: List[Dict[str, str]] = None) -> str:
+    if not create_semantic_chunks:
+        # Services are not loaded yet
+        return "The system is still initializing. Please try again in a moment."
+
+    if not context or not context.strip():
+        # If context is empty, provide a direct, helpful response instead of asking for clarification.
+        return "I could not find any information about that in the uploaded documents. Please ensure the relevant document has been uploaded and processed correctly."
+
+    system_prompt = build_llm_prompt(context, query, history)
 
     try:
-        if LLM_PROVIDER.lower() == "ollama":
-            # Call Ollama
-            response = httpx.post("http://localhost:11434/api/generate", json={
-                "model": "llama3.2:3b",
-                "prompt": system_prompt,
-                "stream": False
-            }, timeout=120.0)
-            if response.status_code == 200:
-                return response.json().get("response", "Error generating response")
+        answer = await llm_client.generate(system_prompt)
+        if answer is None:
             return "Error calling Ollama"
-        else:
-            # Call Gemini
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content(system_prompt)
-            return response.text
+        return answer
     except Exception as e:
         logger.error(f"LLM Generation Error: {e}")
         return f"I encountered an error while processing your request: {str(e)}"
 
-# --- File Processing ---
-def extract_text_from_pdf(file_path):
-    text = ""
-    try:
-        with open(file_path, 'rb') as f:
-            reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-    except Exception as e:
-        logger.error(f"PDF extraction error: {e}")
-    return text
+async def stream_answer_with_llm(context: str, query: str, history: List[Dict[str, str]] = None) -> AsyncIterator[str]:
+    """Streaming counterpart of generate_answer_with_llm; yields answer fragments as they arrive."""
+    if not create_semantic_chunks:
+        yield "The system is still initializing. Please try again in a moment."
+        return
 
-def extract_text_from_docx(file_path):
-    text = ""
-    try:
-        doc = docx.Document(file_path)
-        for para in doc.paragraphs:
-            text += para.text + "\n"
-    except Exception as e:
-        logger.error(f"DOCX extraction error: {e}")
-    return text
+    if not context or not context.strip():
+        yield "I could not find any information about that in the uploaded documents. Please ensure the relevant document has been uploaded and processed correctly."
+        return
+
+    system_prompt = build_llm_prompt(context, query, history)
 
-def extract_text_from_xlsx(file_path):
-    text = ""
     try:
-        wb = load_workbook(file_path, read_only=True, data_only=True)
-        for ws in wb.worksheets:
-            text += f"\nSheet: {ws.title}\n"
-            for row in ws.iter_rows(values_only=True):
-                row_text = " ".join([str(cell) for cell in row if cell is not None])
-                text += row_text + "\n"
-        wb.close()
+        async for fragment in llm_client.stream(system_prompt):
+            yield fragment
     except Exception as e:
-        logger.error(f"XLSX extraction error: {e}")
-    return text
+        logger.error(f"LLM Streaming Error: {e}")
+        yield f"I encountered an error while processing your request: {str(e)}"
+
+# --- Chunk Metadata ---
+# Version 2 keeps only flat scalar fields per chunk; the document structure is
+# stored once per document in documents.metadata and referenced by doc_id.
+# Version 3 adds category and a numeric created_ts so queries can filter on them.
+# Version 4 adds the chunk granularity level; older chunks are all 'standard'.
+# Version 5 rewrites headers the first schema stored as a JSON array into ' | '-joined text.
+CHUNK_METADATA_SCHEMA = 5
+# Marks a collection whose stored chunk keywords are all ranked by corpus TF-IDF
+KEYWORD_RANKING = "tfidf"
+
+def compact_chunk_metadata(chunk: Dict[str, Any], index: int, **document_fields) -> Dict[str, Any]:
+    """Flatten a chunk's metadata into scalar fields for ChromaDB."""
+    meta = {k: v for k, v in chunk['metadata'].items() if k != 'document_structure'}
+    meta.setdefault('page', index)
+    meta['quality_score'] = chunk.get('quality_score', meta.get('estimated_importance', 0.5))
+    meta['keywords'] = ", ".join(chunk.get('keywords', []))
+    meta['headers'] = " | ".join(h.get('text', '') for h in chunk.get('headers', []))
+    meta.update({k: v for k, v in document_fields.items() if v is not None})
+    return meta
+
+def json_array_headers(value: Any) -> Optional[List[str]]:
+    """Header texts of a legacy JSON-array headers field, or None if the value is not one."""
+    if not isinstance(value, str) or not value.startswith('['):
+        return None
+    try:
+        headers = json.loads(value)
+    except json.JSONDecodeError:
+        return None
+    return [str(h) for h in headers] if isinstance(headers, list) else None
+
+def needs_metadata_migration(meta: Dict[str, Any]) -> bool:
+    """Whether a stored chunk predates the current metadata schema."""
+    return ('document_structure' in meta or 'created_ts' not in meta or 'category' not in meta
+            or 'level' not in meta or json_array_headers(meta.get('headers')) is not None)
+
+def migrate_chunk_metadata(collection, documents: Dict[str, Dict[str, Any]], batch_size: int = 500) -> Dict[str, Dict[str, Any]]:
+    """
+    Rewrite chunks stored under an older metadata schema.
+
+    Args:
+        collection: ChromaDB collection
+        documents: Mapping of filename to its documents row (id, category)
+        batch_size: Chunks rewritten per batch
+
+    Returns:
+        Document structure per source filename, to be stored once per document
+    """
+    if (collection.metadata or {}).get('chunk_schema') == CHUNK_METADATA_SCHEMA:
+        return {}
+
+    legacy_ids = []
+    offset = 0
+    while True:
+        batch = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not batch or not batch['ids']:
+            break
+        legacy_ids += [chunk_id for chunk_id, meta in zip(batch['ids'], batch['metadatas'])
+                       if needs_metadata_migration(meta)]
+        offset += len(batch['ids'])
+
+    structures = {}
+    for start in range(0, len(legacy_ids), batch_size):
+        ids = legacy_ids[start:start + batch_size]
+        batch = collection.get(ids=ids, include=["metadatas", "documents", "embeddings"])
+        metadatas = []
+        for meta in batch['metadatas']:
+            source = meta.get('source', 'unknown')
+            raw_structure = meta.pop('document_structure', None)
+            if raw_structure is not None and source not in structures:
+                try:
+                    structures[source] = json.loads(raw_structure) if isinstance(raw_structure, str) else raw_structure
+                except json.JSONDecodeError:
+                    structures[source] = {}
+            meta.setdefault('quality_score', meta.get('estimated_importance', 0.5))
+            meta.setdefault('level', 'standard')
+            headers = json_array_headers(meta.get('headers'))
+            if headers is not None:
+                # decode_chunk_metadata splits on ' | '; a JSON array would come back as one bogus header
+                meta['headers'] = " | ".join(headers)
+            if 'created_ts' not in meta:
+                try:
+                    meta['created_ts'] = int(datetime.fromisoformat(meta['created_at']).timestamp())
+                except (KeyError, ValueError):
+                    meta['created_ts'] = 0
+            document = documents.get(source)
+            if document:
+                meta['doc_id'] = document['id']
+                meta.setdefault('category', document['category'])
+            metadatas.append(meta)
+
+        # Delete and re-add so the dropped key does not survive a metadata merge
+        collection.delete(ids=batch['ids'])
+        collection.add(ids=batch['ids'], documents=batch['documents'],
+                       embeddings=batch['embeddings'], metadatas=metadatas)
+
+    collection.modify(metadata={**(collection.metadata or {}), 'chunk_schema': CHUNK_METADATA_SCHEMA})
+    if legacy_ids:
+        logger.info(f"Migrated {len(legacy_ids)} chunks to chunk metadata schema {CHUNK_METADATA_SCHEMA}.")
+    return structures
+
+async def migrate_collection_metadata():
+    """Migrate legacy chunk metadata and store each document's structure once in PostgreSQL."""
+    documents = {}
+    async for db in get_db():
+        if db:
+            async with db.cursor(row_factory=dict_row) as acur:
+                await acur.execute("SELECT id, filename, category FROM documents")
+                documents = {row['filename']: row for row in await acur.fetchall()}
+
+    structures = await asyncio.to_thread(migrate_chunk_metadata, collection, documents)
+    if not structures:
+        return
+
+    async for db in get_db():
+        if db:
+            async with db.cursor() as acur:
+                for filename, structure in structures.items():
+                    await acur.execute(
+                        "UPDATE documents SET metadata = COALESCE(metadata, '{}'::jsonb) || %s::jsonb WHERE filename = %s",
+                        (json.dumps({"structure": structure}), filename)
+                    )
+            await db.commit()
+
+# --- Background Ingestion ---
+def start_ingestion_workers():
+    """Create the extraction/embedding pools, start the job workers and requeue unfinished jobs."""
+    global ingest_pool, embed_executor, ingest_queue
+    # Spawn fresh interpreters: forking would copy torch, BLAS/CUDA threads and the Chroma client
+    ingest_pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                      initializer=init_extraction_worker, initargs=(INGEST_WORKERS,))
+    # A single embedding thread keeps model inference and Chroma writes serialized
+    embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+    ingest_queue = asyncio.Queue()
+    for _ in range(INGEST_WORKERS):
+        ingest_workers.append(asyncio.create_task(ingestion_worker()))
+
+    pending = ingestion_jobs.pending()
+    for job in pending:
+        ingest_queue.put_nowait(job['id'])
+    if pending:
+        logger.info(f"Resuming {len(pending)} pending ingestion jobs.")
+    # Documents orphaned by a bulk run or before a restart store their own chunks now
+    asyncio.get_running_loop().create_task(queue_orphaned_documents())
+
+async def ingestion_worker():
+    """Process queued ingestion jobs one at a time."""
+    while True:
+        job_id = await ingest_queue.get()
+        try:
+            await process_ingestion_job(job_id)
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}")
+            ingestion_jobs.update(job_id, status="failed", error=str(e))
+        finally:
+            ingest_queue.task_done()
+        await queue_orphaned_documents()
 
-def _find_publication_date_in_xlsx(keywords: List[str]):
+async def queue_orphaned_documents():
     """
-    Scans XLSX files in UPLOAD_DIR for rows matching keywords,
-    then attempts to extract a date.
+    Re-ingest documents whose near-duplicate chunks were only stored through another
+    document that has since been deleted or changed, so their content is stored again.
     """
-    files = []
-    if not os.path.exists(UPLOAD_DIR):
+    if ingest_queue is None or not near_duplicate_index.orphaned:
+        return
+    async for db in get_db():
+        if not db:
+            return
+        try:
+            async with db.cursor(row_factory=dict_row) as acur:
+                await acur.execute(
+                    """SELECT id, filename, file_path, file_size_bytes, department, category, uploaded_by, metadata
+                       FROM documents
+                       WHERE filename = ANY(%s) AND NOT COALESCE(metadata, '{}'::jsonb) ? 'duplicate_of'""",
+                    (list(near_duplicate_index.orphaned_groups()),)
+                )
+                rows = await acur.fetchall()
+        except Exception as e:
+            # Left marked as orphaned, so the next call retries
+            logger.error(f"Could not look up orphaned documents: {e}")
+            return
+        filenames = near_duplicate_index.take_orphaned()
+        docs = [doc for doc in rows if doc['filename'] in filenames]
+        for doc in docs:
+            job = ingestion_jobs.create(
+                filename=doc['filename'],
+                file_path=doc['file_path'],
+                department=doc['department'],
+                category=doc['category'],
+                uploaded_by=doc['uploaded_by'],
+                size=doc['file_size_bytes'],
+                sha256=(doc['metadata'] or {}).get('content_hash'),
+                doc_id=doc['id'],
+                reingest=True
+            )
+            ingest_queue.put_nowait(job['id'])
+        if docs:
+            logger.info(f"Re-ingesting {len(docs)} documents whose duplicate chunks lost their original.")
+
+async def process_ingestion_job(job_id: str):
+    """Extract, chunk, record and embed one uploaded file."""
+    job = ingestion_jobs.get(job_id)
+    if job is None or job['status'] in ("completed", "failed"):
+        return
+    filename = job['filename']
+    file_path = job['file_path']
+    loop = asyncio.get_running_loop()
+
+    # An upload of content that was itself still being ingested links to it once it lands
+    if job.get('duplicate_of_job'):
+        if await link_to_ingested_original(job):
+            return
+        job = ingestion_jobs.update(job_id, duplicate_of_job=None)
+
+    # Extraction and chunking are CPU-bound, so they run in the process pool
+    ingestion_jobs.update(job_id, status="extracting")
+    chunk_data, structure = await loop.run_in_executor(
+        ingest_pool, extract_and_chunk, file_path, filename, collection is not None
+    )
+
+    # Index publication dates from journal spreadsheets once, at upload time
+    if is_publication_sheet(filename):
+        try:
+            await asyncio.to_thread(publication_index.add_file, filename, file_path)
+        except Exception as e:
+            logger.error(f"Publication indexing failed for {filename}: {e}")
+
+    # DB Record (written first so chunks can reference the document id; kept on the job for resumes)
+    doc_id = job.get('doc_id')
+    if doc_id is None:
+        async for db in get_db():
+            if db:
+                try:
+                    async with db.cursor() as acur:
+                        await acur.execute(
+                            """INSERT INTO documents (filename, file_path, file_size_bytes, department, category, uploaded_by, metadata)
+                               VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                            (filename, file_path, job.get('size'), job['department'], job['category'],
+                             job['uploaded_by'], json.dumps({"structure": structure, "content_hash": job.get('sha256')}))
+                        )
+                        doc_id = (await acur.fetchone())[0]
+                        await db.commit()
+                except Exception as e:
+                    logger.error(f"DB Insert Error for {filename}: {e}")
+                    await db.rollback()
+        ingestion_jobs.update(job_id, doc_id=doc_id)
+    elif job.get('reingest'):
+        async for db in get_db():
+            if db:
+                async with db.cursor() as acur:
+                    await acur.execute(
+                        "UPDATE documents SET metadata = COALESCE(metadata, '{}'::jsonb) || %s::jsonb WHERE id = %s",
+                        (json.dumps({"structure": structure, "content_hash": job.get('sha256')}), doc_id)
+                    )
+                    await db.commit()
+
+    # Embed and Store on the dedicated embedding thread
+    ingestion_jobs.update(job_id, status="embedding")
+    if job.get('reingest'):
+        # A new version only embeds chunks whose content changed
+        changes = {"added": 0, "kept": 0, "removed": 0}
+        if collection:
+            changes = await loop.run_in_executor(
+                embed_executor, sync_document_chunks, chunk_data, filename,
+                job['department'], job['category'], doc_id
+            )
+        ingestion_jobs.update(job_id, status="completed", chunks=len(chunk_data), changes=changes)
+        return
+
+    stored = 0
+    if collection and chunk_data:
+        stored = await loop.run_in_executor(
+            embed_executor, store_document_chunks, chunk_data, filename,
+            job['department'], job['category'], doc_id
+        )
+
+    ingestion_jobs.update(job_id, status="completed", doc_id=doc_id, chunks=stored)
+
+async def link_to_ingested_original(job: Dict[str, Any]) -> bool:
+    """
+    Resolve a job queued as a duplicate of another in-flight job.
+
+    Returns:
+        True if the job is finished (linked) or re-queued to wait; False if the
+        original failed and this job has to be ingested on its own
+    """
+    original = ingestion_jobs.get(job['duplicate_of_job'])
+    if original and original['status'] not in ("completed", "failed"):
+        # Check again shortly without holding a worker
+        ingestion_jobs.update(job['id'], status="waiting")
+        asyncio.get_running_loop().call_later(DUPLICATE_WAIT_SECONDS, ingest_queue.put_nowait, job['id'])
+        return True
+    if not original or original['status'] == "failed" or original.get('doc_id') is None:
+        return False
+
+    document_id = None
+    async for db in get_db():
+        if db:
+            async with db.cursor(row_factory=dict_row) as acur:
+                await acur.execute("SELECT file_path FROM documents WHERE id = %s", (original['doc_id'],))
+                row = await acur.fetchone()
+            if row is None:
+                return False
+            if os.path.abspath(row['file_path'] or "") != os.path.abspath(job['file_path']):
+                if os.path.exists(job['file_path']):
+                    os.remove(job['file_path'])
+            document_id = await record_duplicate_document(
+                db, job['filename'], row['file_path'], job.get('size'), job['department'], job['category'],
+                job['uploaded_by'], job.get('sha256'), original['doc_id']
+            )
+    ingestion_jobs.update(job['id'], status="completed", doc_id=document_id,
+                          duplicate_of=original['doc_id'], chunks=0)
+    return True
+
+def create_embedder(retriever) -> Optional[BatchEmbedder]:
+    """Batch embedder over the retriever's SentenceTransformer, or None if it is not loaded."""
+    if not retriever or not retriever.embedding_model:
         return None
-        
-    for fn in os.listdir(UPLOAD_DIR):
-        if fn.lower().endswith(".xlsx") and ("journal" in fn.lower() or "journals" in fn.lower()):
-            files.append(os.path.join(UPLOAD_DIR, fn))
-            
-    for fp in files:
+    from advanced_retrieval import EMBEDDING_MODEL_NAME
+    # The backend is part of the cache key: int8 and ONNX vectors differ slightly from fp32
+    return BatchEmbedder(
+        retriever.embedding_model,
+        model_id=f"{EMBEDDING_MODEL_NAME}:{retriever.backend}",
+        cache=EmbeddingCache(EMBEDDING_CACHE_PATH),
+        batch_size=EMBED_BATCH_SIZE
+    )
+
+def embed_texts(texts: List[str]) -> Optional[List[List[float]]]:
+    """Embeddings for texts, or None to let Chroma's embedding function handle them."""
+    if not embedder:
+        return None
+    return embedder.embed(texts)
+
+def build_chunk_metadatas(chunk_data: List[Dict[str, Any]], filename: str, department: str,
+                          category: str, doc_id: Optional[int]) -> List[Dict[str, Any]]:
+    """Compact metadata for every chunk of one document."""
+    now = datetime.now(timezone.utc)
+    return [
+        compact_chunk_metadata(
+            chunk, i,
+            source=filename,
+            department=department,
+            category=category,
+            created_at=now.isoformat(),
+            created_ts=int(now.timestamp()),
+            doc_id=doc_id
+        )
+        for i, chunk in enumerate(chunk_data)
+    ]
+
+def chunk_content_hash(text: str) -> str:
+    """Hash of a chunk's text, used to match chunks across document versions."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def drop_near_duplicates(chunk_data: List[Dict[str, Any]], filename: str,
+                         department: str, category: str) -> List[Dict[str, Any]]:
+    """
+    Drop chunks that nearly repeat each other or a chunk of another document in the same
+    department and category, so a dropped chunk stays reachable under the same filters.
+    Only standard-level chunks are compared; other levels re-window the same text and
+    would otherwise be flagged against it. Their chunks follow the standard decision for
+    the sentences they span: one made mostly of dropped text is dropped too.
+
+    The index change is pending until the caller commits or rolls back the filename's group.
+    """
+    standard = [c for c in chunk_data if c['metadata'].get('level', 'standard') == 'standard']
+    kept = set(near_duplicate_index.deduplicate(
+        [(chunk['embedding_id'], chunk['chunk_text']) for chunk in standard],
+        group=filename, scope=dedup_scope(department, category)
+    ))
+    if len(kept) == len(standard):
+        return chunk_data
+
+    # Sentences stored only through dropped standard chunks (a sentence also in a kept chunk is stored)
+    dropped_sentences, kept_sentences = set(), set()
+    for chunk in standard:
+        span = range(chunk['metadata'].get('sentence_start', 0), chunk['metadata'].get('sentence_end', 0))
+        (kept_sentences if chunk['embedding_id'] in kept else dropped_sentences).update(span)
+    dropped_sentences -= kept_sentences
+
+    def is_kept(chunk: Dict[str, Any]) -> bool:
+        if chunk['metadata'].get('level', 'standard') == 'standard':
+            return chunk['embedding_id'] in kept
+        span = range(chunk['metadata'].get('sentence_start', 0), chunk['metadata'].get('sentence_end', 0))
+        if not span:
+            return True
+        return sum(1 for i in span if i in dropped_sentences) * 2 <= len(span)
+
+    return [chunk for chunk in chunk_data if is_kept(chunk)]
+
+def assign_corpus_keywords(chunk_data: List[Dict[str, Any]], filename: str):
+    """
+    Count a document's terms into the corpus statistics and re-rank every chunk's
+    keywords by TF-IDF. Only standard-level chunks are counted, so the same text
+    stored at several granularities is not counted several times.
+    """
+    chunk_terms = [chunk.get('terms') or text_terms(chunk['chunk_text']) for chunk in chunk_data]
+    keyword_index.add_source(filename, [
+        terms for chunk, terms in zip(chunk_data, chunk_terms)
+        if chunk['metadata'].get('level', 'standard') == 'standard'
+    ])
+    for chunk, keywords in zip(chunk_data, keyword_index.top_keywords(chunk_terms)):
+        chunk['keywords'] = keywords
+
+def rerank_stored_keywords(collection, batch_size: int = 500) -> bool:
+    """
+    Re-rank the keywords of chunks stored before corpus TF-IDF ranking, once per collection.
+    Returns True when every stored chunk carries TF-IDF keywords.
+    """
+    if (collection.metadata or {}).get('keyword_ranking') == KEYWORD_RANKING:
+        return True
+
+    reranked = 0
+    offset = 0
+    while True:
+        batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if not batch or not batch['ids']:
+            break
+        keywords = keyword_index.top_keywords([text_terms(text) for text in batch['documents']])
+        metadatas = [{**(meta or {}), 'keywords': ", ".join(words)}
+                     for meta, words in zip(batch['metadatas'], keywords)]
+        collection.update(ids=batch['ids'], metadatas=metadatas)
+        reranked += len(batch['ids'])
+        offset += len(batch['ids'])
+
+    collection.modify(metadata={**(collection.metadata or {}), 'keyword_ranking': KEYWORD_RANKING})
+    if reranked:
+        logger.info(f"Re-ranked keywords of {reranked} stored chunks by TF-IDF.")
+    return True
+
+def store_document_chunks(chunk_data: List[Dict[str, Any]], filename: str, department: str,
+                          category: str, doc_id: Optional[int]) -> int:
+    """Embed chunks into ChromaDB and the BM25 index; returns the number stored."""
+    chunk_data = drop_near_duplicates(chunk_data, filename, department, category)
+    try:
+        assign_corpus_keywords(chunk_data, filename)
+        documents = [chunk['chunk_text'] for chunk in chunk_data]
+        ids = [chunk['embedding_id'] for chunk in chunk_data]
+        metadatas = build_chunk_metadatas(chunk_data, filename, department, category, doc_id)
+
+        # Chunk ids are deterministic, so upsert keeps a resumed job idempotent
+        collection.upsert(documents=documents, metadatas=metadatas, ids=ids, embeddings=embed_texts(documents))
+    except Exception:
+        # Nothing was stored, so the signatures must not suppress other documents' chunks
+        near_duplicate_index.rollback(filename)
+        raise
+    near_duplicate_index.commit(filename)
+    if lexical_index:
+        lexical_index.add(ids, documents)
+    answer_cache.bump_version()
+    return len(ids)
+
+def document_chunks_where(doc_id: Optional[int], filename: str) -> Dict[str, Any]:
+    """
+    Where clause for one document's chunks. Filenames are not unique across document rows,
+    so chunks are matched by doc_id; source is only used when the document has no id.
+    """
+    return {"doc_id": doc_id} if doc_id is not None else {"source": filename}
+
+def relink_document_chunks(doc_id: int, filename: str, new_filename: str, new_doc_id: int):
+    """Hand a document's stored chunks to another document with identical content."""
+    if collection:
+        stored = collection.get(where=document_chunks_where(doc_id, filename), include=["metadatas"])
+        if stored['ids']:
+            metadatas = [{**(meta or {}), 'source': new_filename, 'doc_id': new_doc_id} for meta in stored['metadatas']]
+            collection.update(ids=stored['ids'], metadatas=metadatas)
+    near_duplicate_index.rename_group(filename, new_filename)
+    keyword_index.rename_source(filename, new_filename)
+
+def remove_document_chunks(doc_id: int, filename: str):
+    """
+    Delete a document's stored chunks and its entries in the corpus indexes.
+    Documents whose near-duplicate chunks were only stored here become orphaned and get their own copies back.
+    """
+    if collection:
+        results = collection.get(where=document_chunks_where(doc_id, filename))
+        if results and results['ids']:
+            collection.delete(ids=results['ids'])
+            if lexical_index:
+                lexical_index.remove(results['ids'])
+    near_duplicate_index.remove_group(filename)
+    keyword_index.remove_source(filename)
+
+def sync_document_chunks(chunk_data: List[Dict[str, Any]], filename: str, department: str,
+                         category: str, doc_id: Optional[int]) -> Dict[str, int]:
+    """
+    Bring a document's stored chunks in line with a new version.
+    Chunks are matched by content hash rather than id, because ids include the
+    chunk index and shift whenever text is inserted or removed upstream. Only chunks
+    of this document row (doc_id) are compared, never another row with the same filename.
+
+    Returns:
+        Counts of added (embedded), kept (metadata refreshed only) and removed chunks
+    """
+    chunk_data = drop_near_duplicates(chunk_data, filename, department, category)
+    try:
+        assign_corpus_keywords(chunk_data, filename)
+        existing = collection.get(where=document_chunks_where(doc_id, filename), include=["documents"])
+        stored_ids: Dict[str, List[str]] = {}
+        for chunk_id, text in zip(existing['ids'], existing['documents']):
+            stored_ids.setdefault(chunk_content_hash(text), []).append(chunk_id)
+
+        metadatas = build_chunk_metadatas(chunk_data, filename, department, category, doc_id)
+        kept_ids, kept_metas = [], []
+        new_chunks, new_metas = [], []
+        for chunk, meta in zip(chunk_data, metadatas):
+            matches = stored_ids.get(chunk_content_hash(chunk['chunk_text']))
+            if matches:
+                kept_ids.append(matches.pop())
+                kept_metas.append(meta)
+            else:
+                new_chunks.append(chunk)
+                new_metas.append(meta)
+        removed_ids = [chunk_id for ids in stored_ids.values() for chunk_id in ids]
+
+        if removed_ids:
+            collection.delete(ids=removed_ids)
+            if lexical_index:
+                lexical_index.remove(removed_ids)
+        if kept_ids:
+            # Positions may have shifted; updating metadata alone does not re-embed
+            collection.update(ids=kept_ids, metadatas=kept_metas)
+        if new_chunks:
+            kept = set(kept_ids)
+            new_ids = [
+                c['embedding_id'] if c['embedding_id'] not in kept
+                else hashlib.md5(f"{filename}_{chunk_content_hash(c['chunk_text'])}".encode()).hexdigest()
+                for c in new_chunks
+            ]
+            documents = [c['chunk_text'] for c in new_chunks]
+            collection.upsert(documents=documents, metadatas=new_metas, ids=new_ids,
+                              embeddings=embed_texts(documents))
+            if lexical_index:
+                lexical_index.add(new_ids, documents)
+    except Exception:
+        near_duplicate_index.rollback(filename)
+        raise
+    near_duplicate_index.commit(filename)
+
+    answer_cache.bump_version()
+    return {"added": len(new_chunks), "kept": len(kept_ids), "removed": len(removed_ids)}
+
+class UploadSizeLimitMiddleware:
+    """
+    Reject multipart bodies over the upload limit while they are still arriving.
+    Starlette spools the whole form before an endpoint runs, so the size check in
+    save_upload_stream alone would only fire once the full body had been received.
+    """
+
+    def __init__(self, app, max_body_bytes: int):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or [])
+        if (scope["type"] != "http" or scope["method"] not in ("POST", "PUT")
+                or not headers.get(b"content-type", b"").startswith(b"multipart/form-data")):
+            await self.app(scope, receive, send)
+            return
+
+        reject = JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            content={"detail": f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"}
+        )
+        content_length = headers.get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await reject(scope, receive, send)
+            return
+
+        # Chunked or understated bodies: count bytes as they arrive and stop reading past the limit
+        received = 0
+        exceeded = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal rejected
+            if not exceeded:
+                await send(message)
+            elif not rejected:
+                # Replace whatever error the app produced for the cut-off body
+                rejected = True
+                await reject(scope, receive, send)
+
         try:
-            wb = load_workbook(filename=fp, read_only=True, data_only=True)
+            await self.app(scope, limited_receive, guarded_send)
         except Exception:
-            continue
-            
-        date_headers = {"date", "date of publication", "published on", "publication date"}
-        
-        for ws in wb.worksheets:
-            header_map = {}
-            try:
-                rows_iter = ws.iter_rows(values_only=True)
-            except Exception:
-                continue
-                
-            first = True
-            for row in rows_iter:
-                vals = [str(c) for c in row if c is not None]
-                row_text = " ".join(vals).lower()
-                
-                if first:
-                    for i, c in enumerate(row):
-                        s = str(c).lower() if c is not None else ""
-                        if any(h in s for h in date_headers):
-                            header_map["date_idx"] = i
-                    first = False
-                    
-                # Check if all keywords are in the row
-                if not all(k in row_text for k in keywords):
-                    continue
-                    
-                date_candidates = []
-                for c in row:
-                    s = str(c) if c is not None else ""
-                    # Try regex for date patterns
-                    if re.search(r"\b20\d{2}-\d{1,2}-\d{1,2}\b", s):
-                        date_candidates.append(s)
-                    elif re.search(r"\b\d{1,2}/\d{1,2}/\d{4}\b", s):
-                        date_candidates.append(s)
-                    elif re.search(r"(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{4}", s, re.IGNORECASE):
-                        date_candidates.append(s)
-                        
-                if not date_candidates and "date_idx" in header_map:
-                    idx = header_map["date_idx"]
-                    if idx < len(row) and row[idx] is not None:
-                        date_candidates.append(str(row[idx]))
-                        
-                if date_candidates:
-                    wb.close()
-                    return date_candidates[0]
-        wb.close()
-    return None
+            if not exceeded:
+                raise
+        if exceeded and not rejected:
+            await reject(scope, receive, send)
 
 # --- App ---
 app = FastAPI(title="MVSR RAG System")
 
+# Added before CORS so CORS wraps it and a 413 still reaches the browser with CORS headers
+app.add_middleware(UploadSizeLimitMiddleware, max_body_bytes=MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -394,13 +1058,40 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     """On startup, initialize all background services in a separate thread."""
+    if not index_lock.acquire():
+        raise RuntimeError(
+            f"Index files are locked by process {index_lock.holder()} (a bulk_ingest run?); "
+            "start the server after it finishes"
+        )
     logger.info("Initializing services. The server will be ready after this completes.")
     await asyncio.to_thread(initialize_services)
+    if collection:
+        try:
+            await migrate_collection_metadata()
+        except Exception as e:
+            logger.error(f"Chunk metadata migration failed: {e}")
+    start_ingestion_workers()
     logger.info("Service initialization complete. Server is now ready to accept requests.")
         
     if SECRET_KEY == "your-secret-key-here":
         logger.warning("Security warning: Using default SECRET_KEY. Please set a strong, unique key in your environment variables.")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop ingestion workers, persist pending index updates and release pooled LLM connections."""
+    for worker in ingest_workers:
+        worker.cancel()
+    if ingest_pool:
+        ingest_pool.shutdown(wait=False, cancel_futures=True)
+    if embed_executor:
+        embed_executor.shutdown(wait=False, cancel_futures=True)
+    if lexical_index:
+        lexical_index.flush()
+    near_duplicate_index.flush()
+    keyword_index.flush()
+    index_lock.release()
+    await llm_client.aclose()
+
 @app.get("/health")
 async def health_check(db = Depends(get_db)):
     db_status = "connected"
@@ -409,7 +1100,7 @@ async def health_check(db = Depends(get_db)):
 
     return {
         "status": "active", 
-        "llm_health": check_llm_health(),
+        "llm_health": await llm_client.health(gemini_configured=bool(GEMINI_API_KEY)),
         "database_status": db_status
     }
 
@@ -434,19 +1125,10 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     access_token = create_access_token(data={"sub": user['username']})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.post("/api/query")
-async def query_documents(
-    query_request: Dict[str, Any],
-    current_user: dict = Depends(get_current_user)
-):
-    query = query_request.get("query", "")
-    history = query_request.get("history", [])  # Get history from request
-    if not query:
-        raise HTTPException(status_code=400, detail="Query is empty")
-
-    # 1. Intent Analysis / Special Handling
+def answer_publication_date_query(query: str) -> Optional[Dict[str, Any]]:
+    """Answer "when did X publish Y" queries directly from the journal spreadsheets."""
     query_lower = query.lower()
-    
+
     # Check for specific author/journal date query
     # E.g., "when did sharath kumar published journal of elictrical systems?"
     if "when" in query_lower and "publish" in query_lower:
@@ -457,59 +1139,217 @@ async def query_documents(
         stop = {"when", "did", "published", "publish", "in", "the", "of", "journal"}
         keywords = [t for t in tokens if t not in stop]
         
-        # Try to find a date in XLSX
-        date_found = _find_publication_date_in_xlsx(keywords) # Pass the whole list
+        # Look the date up in the publication index built from the journal spreadsheets
+        date_found = publication_index.find_date(keywords) # Pass the whole list
         if date_found:
             return {"answer": f"According to the records, it was published on {date_found}.", "sources": ["journals.xlsx"]}
 
-    # 2. Advanced RAG Retrieval
+    return None
+
+def chunk_from_chroma(doc: str, meta: Dict[str, Any], distance: Optional[float] = None,
+                      embedding=None) -> Dict[str, Any]:
+    """Rebuild a chunk dictionary from a ChromaDB document and its flat metadata."""
+    # The 'chunk_text' is the document itself
+    chunk_dict = {'chunk_text': doc, **meta}
+    if distance is not None:
+        chunk_dict['distance'] = distance
+    if embedding is not None:
+        chunk_dict['embedding'] = embedding
+    return chunk_dict
+
+def keyword_prefilter(query: str, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Keep candidates whose stored keywords contain one of the query's rare terms.
+    Falls back to all candidates when the query has no rare terms or too few chunks match,
+    so the prefilter only trims re-ranking work and never empties the result.
+    """
+    if not keywords_ranked:
+        # Chunks stored before TF-IDF ranking carry raw-frequency keywords that miss rare terms
+        return chunks
+    rare_terms = keyword_index.discriminative_terms(text_terms(query), KEYWORD_PREFILTER_MAX_DF)
+    if not rare_terms:
+        return chunks
+    matched = [
+        chunk for chunk in chunks
+        if rare_terms.intersection(k.strip() for k in str(chunk.get('keywords', '')).split(','))
+    ]
+    return matched if len(matched) >= KEYWORD_PREFILTER_MIN_CANDIDATES else chunks
+
+def decode_chunk_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Expand flat string fields into lists; only done for chunks that reach the prompt."""
+    if isinstance(chunk.get('keywords'), str):
+        chunk['keywords'] = [k.strip() for k in chunk['keywords'].split(',') if k.strip()]
+    if isinstance(chunk.get('headers'), str):
+        chunk['headers'] = [h.strip() for h in chunk['headers'].split(' | ') if h.strip()]
+    return chunk
+
+def choose_chunk_level(query: str, requested: Optional[str] = None) -> str:
+    """
+    Pick the chunk granularity for a query: an explicit request wins, overview
+    questions read summary chunks, everything else reads standard chunks.
+    Levels that are not ingested (see CHUNK_LEVELS) resolve to standard.
+    """
+    if requested and requested != "auto" and requested not in CHUNK_LEVEL_NAMES:
+        raise HTTPException(status_code=400, detail=f"Invalid level: expected one of {', '.join(CHUNK_LEVEL_NAMES)} or auto")
+    if requested in CHUNK_LEVEL_NAMES:
+        level = requested
+    elif SUMMARY_QUERY_PATTERN.search(query):
+        level = "summary"
+    else:
+        level = "standard"
+    return level if level in INGEST_CHUNK_LEVELS else "standard"
+
+def chunk_level_condition(level: str) -> Dict[str, Any]:
+    """
+    Where clause for a granularity. Standard chunks always match too, because some documents
+    only have them (spreadsheet records, chunks stored before levels existed); see prefer_chunk_level.
+    """
+    if level == "standard":
+        return {"level": "standard"}
+    return {"level": {"$in": [level, "standard"]}}
+
+def prefer_chunk_level(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Drop standard chunks of sources that also have chunks of the requested (non-standard)
+    level among the candidates, so a document's text is not read at two granularities.
+    """
+    covered = {chunk.get('source') for chunk in chunks if chunk.get('level', 'standard') != 'standard'}
+    if not covered:
+        return chunks
+    return [chunk for chunk in chunks
+            if chunk.get('level', 'standard') != 'standard' or chunk.get('source') not in covered]
+
+def request_string(query_request: Dict[str, Any], field: str, default: Optional[str] = None) -> Optional[str]:
+    """A string field of a JSON request body; any other JSON type is a 400, not a 500."""
+    value = query_request.get(field, default)
+    if value is not None and not isinstance(value, str):
+        raise HTTPException(status_code=400, detail=f"Invalid {field}: expected a string")
+    return value
+
+def build_query_filter(query_request: Dict[str, Any], current_user: dict) -> Optional[Dict[str, Any]]:
+    """
+    Translate department, category, date-range and granularity request fields into a ChromaDB where clause.
+    The user's own department is the default scope; "all" searches every department.
+    """
+    conditions = [chunk_level_condition(choose_chunk_level(query_request.get("query", ""), query_request.get("level")))]
+    department = request_string(query_request, "department", current_user.get("department"))
+    if department and department.lower() != "all":
+        conditions.append({"department": department})
+    category = request_string(query_request, "category")
+    if category and category.lower() != "all":
+        conditions.append({"category": category})
+
+    for field, operator in (("date_from", "$gte"), ("date_to", "$lte")):
+        value = request_string(query_request, field)
+        if not value:
+            continue
+        try:
+            bound = datetime.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid {field}: expected an ISO date")
+        if bound.tzinfo is None:
+            bound = bound.replace(tzinfo=timezone.utc)
+        if operator == "$lte" and len(value) == 10:
+            # A bare end date includes the whole day
+            bound += timedelta(days=1, seconds=-1)
+        conditions.append({"created_ts": {operator: int(bound.timestamp())}})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def retrieve_context(query: str, where: Optional[Dict[str, Any]] = None,
+                     budget: Optional[LatencyBudget] = None,
+                     query_embedding=None) -> Tuple[str, List[str]]:
+    """
+    Run the retrieval pipeline for a query and return (context, sources).
+    Stages that would overrun their deadline in the budget are skipped or cut
+    down, and recorded in budget.skipped. query_embedding reuses the vector
+    already computed for the answer-cache lookup.
+    """
     context = ""
     sources = []
+    budget = budget or LatencyBudget(QUERY_BUDGET_MS, STAGE_DEADLINES_MS)
     
     if collection and retriever and context_optimizer:
         try:
-            # 2.1. Initial Candidate Retrieval (from ChromaDB)
+            # 2.1. Initial Candidate Retrieval (vector search from ChromaDB)
             initial_results = collection.query(
-                query_texts=[query],
-                n_results=20  # Retrieve more candidates for re-ranking
+                **vector_query_args(query, query_embedding),
+                n_results=VECTOR_CANDIDATES,  # Retrieve more candidates for re-ranking
+                where=where,  # Push department/category/date filters into the ANN search
+                include=["documents", "metadatas", "distances", "embeddings"]  # Reuse stored vectors for MMR
             )
-            
-            if initial_results and initial_results['documents']:
-                # Reconstruct chunk dictionaries from ChromaDB results
-                candidate_chunks = []
-                for i, doc in enumerate(initial_results['documents'][0]):
-                    meta = initial_results['metadatas'][0][i]
-                    
-                    # Parse JSON strings back into objects
-                    if 'document_structure' in meta and isinstance(meta['document_structure'], str):
-                        try:
-                            meta['document_structure'] = json.loads(meta['document_structure'])
-                        except json.JSONDecodeError:
-                            # Handle cases where the string is not valid JSON
-                            meta['document_structure'] = {}
-                    if 'headers' in meta and isinstance(meta['headers'], str):
-                        try:
-                            meta['headers'] = json.loads(meta['headers'])
-                        except json.JSONDecodeError:
-                            meta['headers'] = []
-                    if 'keywords' in meta and isinstance(meta['keywords'], str):
-                        meta['keywords'] = [k.strip() for k in meta['keywords'].split(',')]
-
-
-                    # The 'chunk_text' is the document itself
-                    chunk_dict = {'chunk_text': doc, **meta}
-                    candidate_chunks.append(chunk_dict)
-
-                # 2.2. Re-ranking with Cross-Encoder
-                reranked_chunks = retriever.rerank_chunks(query, candidate_chunks, top_k=10)
-
-                # 2.3. Source Prioritization
+
+            candidates_by_id = {}
+            vector_ids = []
+            if initial_results and initial_results['ids']:
+                embeddings = initial_results.get('embeddings')
+                for i, chunk_id in enumerate(initial_results['ids'][0]):
+                    candidates_by_id[chunk_id] = chunk_from_chroma(
+                        initial_results['documents'][0][i],
+                        initial_results['metadatas'][0][i],
+                        distance=initial_results['distances'][0][i] if initial_results.get('distances') else None,
+                        embedding=embeddings[0][i] if embeddings is not None else None
+                    )
+                    vector_ids.append(chunk_id)
+
+            # 2.2. Lexical Retrieval (BM25) merged with Reciprocal Rank Fusion
+            lexical_ids = []
+            if lexical_index and not budget.allows("retrieval"):
+                budget.skip("lexical")
+            elif lexical_index:
+                lexical_ids = [chunk_id for chunk_id, _ in lexical_index.search(query, top_k=LEXICAL_CANDIDATES)]
+                if lexical_ids and where:
+                    # Apply the same filters to lexical hits before they take candidate slots
+                    allowed = set(collection.get(ids=lexical_ids, where=where, include=[])['ids'])
+                    lexical_ids = [chunk_id for chunk_id in lexical_ids if chunk_id in allowed]
+            fused_ids = reciprocal_rank_fusion([vector_ids, lexical_ids])[:RERANK_CANDIDATES]
+
+            missing_ids = [chunk_id for chunk_id in fused_ids if chunk_id not in candidates_by_id]
+            if missing_ids:
+                fetched = collection.get(ids=missing_ids, include=["documents", "metadatas", "embeddings"])
+                fetched_embeddings = fetched.get('embeddings')
+                for i, chunk_id in enumerate(fetched['ids']):
+                    candidates_by_id[chunk_id] = chunk_from_chroma(
+                        fetched['documents'][i],
+                        fetched['metadatas'][i],
+                        embedding=fetched_embeddings[i] if fetched_embeddings is not None else None
+                    )
+
+            candidate_chunks = [candidates_by_id[chunk_id] for chunk_id in fused_ids if chunk_id in candidates_by_id]
+            candidate_chunks = prefer_chunk_level(candidate_chunks)
+            candidate_chunks = keyword_prefilter(query, candidate_chunks)
+
+            if candidate_chunks:
+                # 2.3. Re-ranking with Cross-Encoder (smaller top-N or fused order when short on time)
+                rerank_ms = budget.remaining_ms("rerank")
+                rerank_window_ms = STAGE_DEADLINES_MS["rerank"] - STAGE_DEADLINES_MS["retrieval"]
+                if rerank_ms <= 0:
+                    budget.skip("rerank")
+                    reranked_chunks = candidate_chunks[:10]
+                else:
+                    if rerank_ms < rerank_window_ms / 2:
+                        budget.skip("rerank_full")
+                        candidate_chunks = candidate_chunks[:RERANK_REDUCED_CANDIDATES]
+                    reranked_chunks = retriever.rerank_chunks(query, candidate_chunks, top_k=10,
+                                                              timeout=rerank_ms / 1000)
+                    # Without a cross-encoder nothing is scored by design; that is not a skipped stage
+                    if retriever.cross_encoder and not all('rerank_score' in chunk for chunk in reranked_chunks):
+                        budget.skip("rerank")
+
+                # 2.4. Source Prioritization
                 prioritized_chunks = context_optimizer.prioritize_sources(reranked_chunks)
 
-                # 2.4. Diverse Retrieval
-                diverse_chunks = retriever.diverse_retrieval(prioritized_chunks, max_chunks=7)
+                # 2.5. Diverse Retrieval
+                if budget.allows("mmr"):
+                    diverse_chunks = retriever.diverse_retrieval(prioritized_chunks, max_chunks=7)
+                else:
+                    budget.skip("mmr")
+                    diverse_chunks = prioritized_chunks[:7]
                 
-                # 2.5. Context Compression & Final Context Assembly
+                # 2.6. Context Compression & Final Context Assembly
+                diverse_chunks = [decode_chunk_metadata(chunk) for chunk in diverse_chunks]
                 window_size = retriever.dynamic_context_window(query)
                 context = context_optimizer.compress_context(diverse_chunks, max_tokens=window_size)
                 
@@ -524,7 +1364,7 @@ async def query_documents(
     if (not context or "Error retrieving documents" in context) and collection:
         logger.info("Falling back to simple RAG retrieval.")
         try:
-            results = collection.query(query_texts=[query], n_results=5)
+            results = collection.query(**vector_query_args(query, query_embedding), n_results=5, where=where)
             if results and results['documents']:
                 context = "\n".join(results['documents'][0])
                 if results['metadatas']:
@@ -541,10 +1381,168 @@ async def query_documents(
                 with open(os.path.join(UPLOAD_DIR, fn), 'r') as f:
                     context += f.read()[:1000] + "\n"
 
-    # 3. Generate Answer
-    answer = generate_answer_with_llm(context, query, history) # Pass history
+    return context, list(set(sources))
+
+def vector_query_args(query: str, query_embedding=None) -> Dict[str, Any]:
+    """
+    Query Chroma with the same model that embedded the chunks, when it is loaded.
+    Queries are encoded directly rather than through the embedding cache: one-off
+    texts would grow it without bound and put a SQLite commit on the request path.
+    """
+    if embedder:
+        if query_embedding is None:
+            query_embedding = retriever.embed_query(query)
+        return {"query_embeddings": [[float(x) for x in query_embedding]]}
+    return {"query_texts": [query]}
+
+def embed_query_for_cache(query: str):
+    """Embed a query for answer-cache lookup; returns None when embeddings are unavailable."""
+    if not retriever:
+        return None
+    try:
+        return retriever.embed_query(query)
+    except Exception as e:
+        logger.warning(f"Query embedding for answer cache failed: {e}")
+        return None
+
+def is_cacheable_answer(answer: str) -> bool:
+    """Only cache real answers, never transient errors or start-up notices."""
+    transient_prefixes = ("I encountered an error", "Error calling Ollama", "The system is still initializing",
+                          LLM_BUDGET_EXCEEDED_MESSAGE)
+    return bool(answer) and not answer.startswith(transient_prefixes)
+
+LLM_BUDGET_EXCEEDED_MESSAGE = "The answer could not be generated within the time limit. The most relevant sources are listed below."
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a server-sent event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/query")
+async def query_documents(
+    query_request: Dict[str, Any],
+    current_user: dict = Depends(get_current_user)
+):
+    query = query_request.get("query", "")
+    history = query_request.get("history", [])  # Get history from request
+    if not query:
+        raise HTTPException(status_code=400, detail="Query is empty")
+
+    # 1. Intent Analysis / Special Handling
+    direct_answer = answer_publication_date_query(query)
+    if direct_answer:
+        return direct_answer
+
+    where = build_query_filter(query_request, current_user)
+
+    # Identical concurrent requests share a single pipeline run, success or failure
+    flight_key = SingleFlight.make_key(" ".join(query.lower().split()), history, where,
+                                       answer_cache.corpus_version)
+    result = await query_flight.do(flight_key, lambda: answer_query(query, history, where))
+    return dict(result)
+
+async def answer_query(query: str, history: List[Dict[str, Any]],
+                       where: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Run cache lookup, retrieval and generation for one query."""
+    budget = LatencyBudget(QUERY_BUDGET_MS, STAGE_DEADLINES_MS)
+    cache_scope = json.dumps(where, sort_keys=True) if where else ""
+
+    # 2. Semantic Answer Cache (follow-ups depend on history, so only standalone queries are cached)
+    corpus_version = answer_cache.corpus_version
+    query_embedding = None
+    if not history:
+        query_embedding = await asyncio.to_thread(embed_query_for_cache, query)
+        if query_embedding is not None:
+            cached = answer_cache.get(query_embedding, scope=cache_scope)
+            if cached:
+                return {**cached, "cached": True}
+
+    # 3. Advanced RAG Retrieval
+    context, sources = await asyncio.to_thread(retrieve_context, query, where, budget, query_embedding)
+
+    # 4. Generate Answer within whatever is left of the budget
+    try:
+        answer = await asyncio.wait_for(
+            generate_answer_with_llm(context, query, history), # Pass history
+            timeout=max(budget.remaining_ms(), 0) / 1000
+        )
+    except asyncio.TimeoutError:
+        budget.skip("llm")
+        answer = LLM_BUDGET_EXCEEDED_MESSAGE
     
-    return {"answer": answer, "sources": list(set(sources))}
+    result = {"answer": answer, "sources": sources}
+    if query_embedding is not None and is_cacheable_answer(answer) and not budget.skipped:
+        answer_cache.put(query.strip().lower(), query_embedding, result, corpus_version, scope=cache_scope)
+    return {**result, "skipped_stages": budget.skipped}
+
+@app.post("/api/query/stream")
+async def query_documents_stream(
+    query_request: Dict[str, Any],
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Streaming variant of /api/query.
+    Emits a `sources` event once retrieval finishes, then `token` events as the
+    LLM generates, then a final `done` event.
+    """
+    budget = LatencyBudget(QUERY_BUDGET_MS, STAGE_DEADLINES_MS)
+    query = query_request.get("query", "")
+    history = query_request.get("history", [])
+    if not query:
+        raise HTTPException(status_code=400, detail="Query is empty")
+    where = build_query_filter(query_request, current_user)
+    cache_scope = json.dumps(where, sort_keys=True) if where else ""
+
+    async def event_stream():
+        direct_answer = answer_publication_date_query(query)
+        if direct_answer:
+            yield format_sse("sources", {"sources": direct_answer["sources"]})
+            yield format_sse("token", {"text": direct_answer["answer"]})
+            yield format_sse("done", {})
+            return
+
+        corpus_version = answer_cache.corpus_version
+        query_embedding = None
+        if not history:
+            query_embedding = await asyncio.to_thread(embed_query_for_cache, query)
+            if query_embedding is not None:
+                cached = answer_cache.get(query_embedding, scope=cache_scope)
+                if cached:
+                    yield format_sse("sources", {"sources": cached["sources"]})
+                    yield format_sse("token", {"text": cached["answer"]})
+                    yield format_sse("done", {"cached": True})
+                    return
+
+        context, sources = await asyncio.to_thread(retrieve_context, query, where, budget, query_embedding)
+        yield format_sse("sources", {"sources": sources})
+
+        # Stop forwarding tokens once the overall budget is spent
+        fragments = []
+        answer_stream = stream_answer_with_llm(context, query, history)
+        try:
+            while True:
+                fragment = await asyncio.wait_for(
+                    answer_stream.__anext__(), timeout=max(budget.remaining_ms(), 0) / 1000
+                )
+                fragments.append(fragment)
+                yield format_sse("token", {"text": fragment})
+        except StopAsyncIteration:
+            pass
+        except asyncio.TimeoutError:
+            budget.skip("llm")
+        finally:
+            await answer_stream.aclose()
+        yield format_sse("done", {"skipped_stages": budget.skipped})
+
+        answer = "".join(fragments)
+        if query_embedding is not None and is_cacheable_answer(answer) and not budget.skipped:
+            answer_cache.put(query.strip().lower(), query_embedding,
+                             {"answer": answer, "sources": sources}, corpus_version, scope=cache_scope)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/api/documents", response_model=List[Dict[str, Any]])
 async def get_documents(
@@ -563,6 +1561,83 @@ async def get_documents(
         documents = await acur.fetchall()
     return documents
 
+async def save_upload_stream(file: UploadFile, file_path: str) -> Tuple[int, str]:
+    """
+    Stream an upload to disk in fixed-size chunks, hashing as it goes.
+    The data lands in a temp file that is renamed into place only once complete.
+
+    Returns:
+        Tuple of (size in bytes, SHA-256 hex digest)
+    """
+    tmp_path = os.path.join(UPLOAD_DIR, f".{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as buffer:
+            while True:
+                block = await file.read(UPLOAD_CHUNK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"
+                    )
+                digest.update(block)
+                await buffer.write(block)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return size, digest.hexdigest()
+
+def unique_upload_path(filename: str) -> str:
+    """
+    Fresh upload path for a new document, e.g. report.3f9a2c1b.pdf. Filenames are not
+    unique across documents, so a new upload never reuses (and overwrites) another's file.
+    """
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(UPLOAD_DIR, f"{stem}.{uuid.uuid4().hex[:8]}{ext}")
+
+def versioned_upload_path(filename: str, document_id: int, version: int) -> str:
+    """Upload path for one version of one document, e.g. report.d12.v2.pdf."""
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(UPLOAD_DIR, f"{stem}.d{document_id}.v{version}{ext}")
+
+async def find_duplicate_document(db, content_hash: str, department: str,
+                                  category: str) -> Optional[Dict[str, Any]]:
+    """
+    Find an indexed document with the same content in the same department and category.
+    Only documents that own their chunks are returned, never links to other documents.
+    """
+    if not db:
+        return None
+    async with db.cursor(row_factory=dict_row) as acur:
+        await acur.execute(
+            """SELECT id, filename, file_path FROM documents
+               WHERE metadata @> %s::jsonb AND NOT metadata ? 'duplicate_of'
+                 AND department = %s AND category = %s
+               ORDER BY id LIMIT 1""",
+            (json.dumps({"content_hash": content_hash}), department, category)
+        )
+        return await acur.fetchone()
+
+async def record_duplicate_document(db, filename: str, file_path: str, size: int, department: str,
+                                    category: str, uploaded_by: str, content_hash: str,
+                                    original_id: int) -> int:
+    """Insert a document row that links to another document's chunks instead of owning any."""
+    async with db.cursor() as acur:
+        await acur.execute(
+            """INSERT INTO documents (filename, file_path, file_size_bytes, department, category, uploaded_by, metadata)
+               VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+            (filename, file_path, size, department, category, uploaded_by,
+             json.dumps({"content_hash": content_hash, "duplicate_of": original_id}))
+        )
+        document_id = (await acur.fetchone())[0]
+        await db.commit()
+    return document_id
+
 @app.post("/api/upload")
 async def upload_file(
     file: UploadFile = File(...),
@@ -571,80 +1646,157 @@ async def upload_file(
     current_user: dict = Depends(get_current_user),
     db: psycopg.AsyncConnection = Depends(get_db)
 ):
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
+    file_path = unique_upload_path(file.filename)
     try:
-        async with aiofiles.open(file_path, "wb") as buffer:
-            content = await file.read()
-            await buffer.write(content)
+        size, content_hash = await save_upload_stream(file, file_path)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to write file {file.filename}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
 
-    # Extract text
-    text = ""
-    if file.filename.endswith(".pdf"):
-        text = extract_text_from_pdf(file_path)
-    elif file.filename.endswith(".xlsx"):
-        text = extract_text_from_xlsx(file_path)
-    elif file.filename.endswith(".docx"):
-        text = extract_text_from_docx(file_path)
-    elif file.filename.endswith(".txt"):
-        try:
-            async with aiofiles.open(file_path, "r", encoding="utf-8") as f:
-                text = await f.read()
-        except Exception as e:
-            logger.error(f"Failed to read text file {file.filename}: {e}")
-            # Decide if you want to stop or continue without text
-            text = "" # Continue without text
+    # Identical content already indexed: link to its chunks instead of re-embedding
+    username = current_user.get('username', 'unknown_user')
+    original = await find_duplicate_document(db, content_hash, department, category)
+    if original:
+        # The link points at the original's file, so this copy is not kept
+        os.remove(file_path)
+        document_id = original['id']
+        if original['filename'] != file.filename:
+            document_id = await record_duplicate_document(
+                db, file.filename, original['file_path'], size, department, category,
+                username, content_hash, original['id']
+            )
+        return {
+            "filename": file.filename,
+            "status": "duplicate",
+            "deduplicated": True,
+            "document_id": document_id,
+            "duplicate_of": {"id": original['id'], "filename": original['filename']}
+        }
+
+    # Identical content still queued or being ingested has no document row yet: wait for it
+    # and link to it then. Lookup and create run without an await in between, so two
+    # uploads handled by this event loop cannot both miss each other.
+    in_flight = ingestion_jobs.find_active(content_hash, department, category)
+    if in_flight and in_flight['filename'] == file.filename:
+        os.remove(file_path)
+        return {
+            "filename": file.filename,
+            "status": "duplicate",
+            "deduplicated": True,
+            "job_id": in_flight['id'],
+            "duplicate_of": {"job_id": in_flight['id'], "filename": in_flight['filename']}
+        }
+
+    # Queue extraction, chunking and embedding; the client polls /api/jobs/{job_id}
+    job = ingestion_jobs.create(
+        filename=file.filename,
+        file_path=file_path,
+        department=department,
+        category=category,
+        uploaded_by=username,
+        size=size,
+        sha256=content_hash,
+        duplicate_of_job=in_flight['id'] if in_flight else None
+    )
+    if ingest_queue is not None:
+        ingest_queue.put_nowait(job['id'])
+
+    if in_flight:
+        return {
+            "filename": file.filename,
+            "status": "duplicate",
+            "deduplicated": True,
+            "job_id": job['id'],
+            "duplicate_of": {"job_id": in_flight['id'], "filename": in_flight['filename']}
+        }
+    return {"filename": file.filename, "status": "queued", "job_id": job['id']}
+
+@app.put("/api/documents/{document_id}")
+async def reingest_document(
+    document_id: int,
+    file: UploadFile = File(...),
+    change_reason: Optional[str] = Form(None),
+    current_user: dict = Depends(get_current_user),
+    db: psycopg.AsyncConnection = Depends(get_db)
+):
+    """Upload a new version of a document; only chunks whose content changed are re-embedded."""
+    if not db:
+        raise HTTPException(status_code=503, detail="Database not available")
 
-    # Embed and Store
-    if collection and text:
-        try:
-            chunk_data = create_semantic_chunks(text, document_id=file.filename)
-            chunk_data = [chunk for chunk in chunk_data if chunk.get('quality_score', 0.3) >= 0.3]
-
-            if chunk_data:
-                documents = [chunk['chunk_text'] for chunk in chunk_data]
-                metadatas = [chunk['metadata'] for chunk in chunk_data]
-                ids = [chunk['embedding_id'] for chunk in chunk_data]
-
-                current_timestamp = datetime.now(timezone.utc).isoformat()
-                for i, meta in enumerate(metadatas):
-                    meta['source'] = file.filename
-                    meta['department'] = department
-                    meta['created_at'] = current_timestamp
-                    if 'page' not in meta:
-                        meta['page'] = i
-                    
-                    if 'document_structure' in meta and isinstance(meta.get('document_structure'), dict):
-                        meta['document_structure'] = json.dumps(meta['document_structure'])
-                    if 'keywords' in meta and isinstance(meta.get('keywords'), list):
-                        meta['keywords'] = ", ".join(meta['keywords'])
-                    if 'headers' in meta and isinstance(meta.get('headers'), list):
-                        meta['headers'] = json.dumps([h.get('text', '') for h in meta['headers']])
-
-                collection.add(documents=documents, metadatas=metadatas, ids=ids)
-        except Exception as e:
-            logger.error(f"Embedding or ChromaDB storage failed for {file.filename}: {e}")
+    async with db.cursor(row_factory=dict_row) as acur:
+        await acur.execute(
+            "SELECT id, filename, file_path, department, category, version, metadata FROM documents WHERE id = %s",
+            (document_id,)
+        )
+        doc = await acur.fetchone()
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if (doc['metadata'] or {}).get('duplicate_of'):
+        raise HTTPException(status_code=409, detail="Document is a duplicate link; update the original instead")
+
+    # The document keeps its filename so chunk sources and citations stay stable. The bytes go
+    # to a new versioned file, so the outgoing version's file (possibly shared with duplicate
+    # links) is never overwritten.
+    file_path = versioned_upload_path(doc['filename'], document_id, doc['version'] + 1)
+    try:
+        size, content_hash = await save_upload_stream(file, file_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to write file {doc['filename']}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
 
+    if (doc['metadata'] or {}).get('content_hash') == content_hash:
+        os.remove(file_path)
+        return {"filename": doc['filename'], "status": "unchanged", "version": doc['version']}
 
-    # DB Record
+    # Record the outgoing version (still pointing at its own file), then point the document at the new one
     username = current_user.get('username', 'unknown_user')
-    if db:
-        try:
-            async with db.cursor() as acur:
-                await acur.execute(
-                    """INSERT INTO documents (filename, file_path, department, category, uploaded_by)
-                       VALUES (%s, %s, %s, %s, %s) RETURNING id""",
-                    (file.filename, file_path, department, category, username)
-                )
-                await db.commit()
-        except Exception as e:
-            logger.error(f"DB Insert Error for {file.filename}: {e}")
-            # Optionally rollback or handle error
-            await db.rollback()
-            
-    return {"filename": file.filename, "status": "uploaded"}
+    try:
+        async with db.cursor() as acur:
+            await acur.execute(
+                """INSERT INTO document_versions (document_id, version_number, filename, uploaded_by, change_reason, file_path, metadata)
+                   SELECT id, version, filename, uploaded_by, %s, file_path, metadata FROM documents WHERE id = %s""",
+                (change_reason, document_id)
+            )
+            await acur.execute(
+                """UPDATE documents SET version = version + 1, file_path = %s, file_size_bytes = %s, uploaded_by = %s,
+                          uploaded_at = CURRENT_TIMESTAMP
+                   WHERE id = %s RETURNING version""",
+                (file_path, size, username, document_id)
+            )
+            version = (await acur.fetchone())[0]
+            await db.commit()
+    except Exception:
+        await db.rollback()
+        os.remove(file_path)
+        raise
+
+    job = ingestion_jobs.create(
+        filename=doc['filename'],
+        file_path=file_path,
+        department=doc['department'],
+        category=doc['category'],
+        uploaded_by=username,
+        size=size,
+        sha256=content_hash,
+        doc_id=document_id,
+        reingest=True
+    )
+    if ingest_queue is not None:
+        ingest_queue.put_nowait(job['id'])
+
+    return {"filename": doc['filename'], "status": "queued", "job_id": job['id'], "version": version}
+
+@app.get("/api/jobs/{job_id}")
+async def get_ingestion_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = ingestion_jobs.get(job_id)
+    # Other users' jobs look missing, so job ids cannot be probed for file paths and departments
+    if job is None or (job.get('uploaded_by') != current_user.get('username') and current_user.get('role') != 'admin'):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -660,7 +1812,7 @@ async def delete_document(
 
     # First, get the filename from the database
     async with db.cursor(row_factory=dict_row) as acur:
-        await acur.execute("SELECT filename FROM documents WHERE id = %s", (document_id,))
+        await acur.execute("SELECT filename, metadata FROM documents WHERE id = %s", (document_id,))
         doc = await acur.fetchone()
         if not doc:
             raise HTTPException(status_code=404, detail="Document not found")
@@ -671,11 +1823,47 @@ async def delete_document(
         await acur.execute("DELETE FROM documents WHERE id = %s", (document_id,))
         await db.commit()
 
-    # Delete from ChromaDB
-    if collection:
-        # Find all chunks associated with the file
-        results = collection.get(where={"source": filename})
-        if results and results['ids']:
-            collection.delete(ids=results['ids'])
+    # A deduplicated upload only links to another document's chunks
+    if (doc['metadata'] or {}).get('duplicate_of'):
+        return
+
+    # Hand the content over to the oldest duplicate so its chunks survive this delete
+    async with db.cursor(row_factory=dict_row) as acur:
+        await acur.execute(
+            """SELECT id, filename, file_path, department, category, uploaded_by FROM documents
+               WHERE metadata @> %s::jsonb ORDER BY id""",
+            (json.dumps({"duplicate_of": document_id}),)
+        )
+        duplicates = await acur.fetchall()
+    if duplicates:
+        heir = duplicates[0]
+        async with db.cursor() as acur:
+            await acur.execute(
+                "UPDATE documents SET metadata = (metadata - 'duplicate_of') || %s::jsonb WHERE id = %s",
+                (json.dumps({"structure": (doc['metadata'] or {}).get('structure', {})}), heir['id'])
+            )
+            await acur.execute(
+                "UPDATE documents SET metadata = metadata || %s::jsonb WHERE id = ANY(%s)",
+                (json.dumps({"duplicate_of": heir['id']}), [d['id'] for d in duplicates[1:]])
+            )
+            await db.commit()
+        # Same content, department and category: the stored chunks only change owner
+        await asyncio.get_running_loop().run_in_executor(
+            embed_executor, relink_document_chunks, document_id, filename, heir['filename'], heir['id']
+        )
+        if is_publication_sheet(filename):
+            publication_index.remove_source(filename)
+            if is_publication_sheet(heir['filename']):
+                await asyncio.to_thread(publication_index.add_file, heir['filename'], heir['file_path'])
+        answer_cache.bump_version()
+        return
+
+    # Delete chunks and index entries on the embedding thread, after any write still in flight
+    await asyncio.get_running_loop().run_in_executor(
+        embed_executor, remove_document_chunks, document_id, filename
+    )
+    publication_index.remove_source(filename)
+    answer_cache.bump_version()
+    await queue_orphaned_documents()
 
     return
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+"""
+Bulk Ingestion for RAG System
+Indexes a whole directory of documents without going through /api/upload:
+extraction and chunking fan out across all cores, chunks are embedded and
+written to ChromaDB and PostgreSQL in large batches, and a checkpoint manifest
+lets an interrupted run resume where it stopped.
+
+The backend must be stopped while this runs: both keep the BM25, near-duplicate,
+keyword and publication indexes in memory and rewrite their files, so they share
+an exclusive index lock and this script exits if the server holds it.
+
+Usage:
+    python bulk_ingest.py <directory> --department CSE --category research
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Tuple, Optional
+
+from document_ingestion import SUPPORTED_EXTENSIONS, extract_and_chunk, file_sha256, init_extraction_worker
+from index_lock import IndexLock
+
+# (file_path, source, sha256, size, chunk_data, structure)
+ExtractedFile = Tuple[str, str, str, int, List[Dict[str, Any]], Dict[str, Any]]
+
+def extract_file(file_path: str, source: str) -> ExtractedFile:
+    """Hash, extract and chunk one file inside a worker process."""
+    chunk_data, structure = extract_and_chunk(file_path, source)
+    return file_path, source, file_sha256(file_path), os.path.getsize(file_path), chunk_data, structure
+
+def source_name(file_path: str, directory: str) -> str:
+    """
+    Name a file by its path relative to the ingested directory, so files with the same
+    basename in different subdirectories get distinct chunk ids and sources.
+    """
+    return os.path.relpath(file_path, directory).replace(os.sep, "/")
+
+def find_files(directory: str) -> List[str]:
+    """All supported documents under a directory, in a stable order."""
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        for fn in filenames:
+            if fn.lower().endswith(SUPPORTED_EXTENSIONS):
+                paths.append(os.path.abspath(os.path.join(root, fn)))
+    return sorted(paths)
+
+def file_signature(file_path: str) -> Dict[str, int]:
+    """Cheap change detector used to decide whether a checkpointed file can be skipped."""
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+class Manifest:
+    """Checkpoint of files already written to ChromaDB and PostgreSQL."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f)
+
+    def is_done(self, file_path: str) -> bool:
+        entry = self.files.get(file_path)
+        return entry is not None and entry['signature'] == file_signature(file_path)
+
+    def mark_done(self, file_path: str, **fields):
+        self.files[file_path] = {'signature': file_signature(file_path), **fields}
+
+    def save(self):
+        """Atomically write the manifest."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.files, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+class BulkWriter:
+    """Buffers extracted files and writes them to PostgreSQL, ChromaDB and the BM25 index in batches."""
+
+    def __init__(self, backend, collection, lexical_index, embedder, db, manifest: Manifest,
+                 department: str, category: str, uploaded_by: str, batch_size: int):
+        self.backend = backend
+        self.collection = collection
+        self.lexical_index = lexical_index
+        self.embedder = embedder
+        self.db = db
+        self.manifest = manifest
+        self.department = department
+        self.category = category
+        self.uploaded_by = uploaded_by
+        self.batch_size = batch_size
+        self.pending: List[ExtractedFile] = []
+        self.pending_chunks = 0
+        self.files_written = 0
+        self.files_linked = 0
+        self.files_failed = 0
+        self.chunks_written = 0
+        # Content hash -> (doc id, source) of files indexed by this run
+        self.indexed_hashes: Dict[str, Tuple[Optional[int], str]] = {}
+
+    def add(self, result: ExtractedFile):
+        self.pending.append(result)
+        self.pending_chunks += len(result[4])
+        if self.pending_chunks >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered file, then checkpoint them. A failed batch is rolled back and retried on the next run."""
+        if not self.pending:
+            return
+        batch, self.pending, self.pending_chunks = self.pending, [], 0
+        try:
+            self._write(batch)
+        except Exception as e:
+            if self.db:
+                self.db.rollback()
+            self.files_failed += len(batch)
+            print(f"Warning: Failed to write a batch of {len(batch)} files; rerun to retry them: {e}")
+
+    def _find_original(self, cur, content_hash: str,
+                       batch_hashes: Dict[str, Tuple[Optional[int], str]]) -> Optional[Tuple[Optional[int], str]]:
+        """(doc id, source) of an indexed document with the same content, department and category."""
+        original = batch_hashes.get(content_hash) or self.indexed_hashes.get(content_hash)
+        if original or cur is None:
+            return original
+        cur.execute(
+            """SELECT id, filename FROM documents
+               WHERE metadata @> %s::jsonb AND NOT metadata ? 'duplicate_of'
+                 AND department = %s AND category = %s
+               ORDER BY id LIMIT 1""",
+            (json.dumps({"content_hash": content_hash}), self.department, self.category)
+        )
+        row = cur.fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _write(self, batch: List[ExtractedFile]):
+        # 1. Document rows in one transaction, committed only once the chunks are stored.
+        # Content already indexed (by an upload, an earlier run or this one) is linked, not re-indexed.
+        doc_ids: Dict[str, Optional[int]] = {}
+        duplicate_of: Dict[str, Optional[int]] = {}
+        batch_hashes: Dict[str, Tuple[Optional[int], str]] = {}
+        to_index: List[ExtractedFile] = []
+        cur = self.db.cursor() if self.db else None
+        for item in batch:
+            file_path, source, content_hash, size, _, structure = item
+            original = self._find_original(cur, content_hash, batch_hashes)
+            metadata = {"content_hash": content_hash}
+            if original:
+                duplicate_of[file_path] = original[0]
+                metadata["duplicate_of"] = original[0]
+            else:
+                metadata["structure"] = structure
+                to_index.append(item)
+            if cur:
+                cur.execute(
+                    """INSERT INTO documents (filename, file_path, file_size_bytes, department, category, uploaded_by, metadata)
+                       VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                    (source, file_path, size, self.department, self.category, self.uploaded_by, json.dumps(metadata))
+                )
+                doc_ids[file_path] = cur.fetchone()[0]
+            if not original:
+                batch_hashes[content_hash] = (doc_ids.get(file_path), source)
+
+        # 2. One embedding pass for all chunks in the batch
+        deduplicated: List[str] = []
+        try:
+            ids, documents, metadatas = [], [], []
+            for file_path, filename, _, _, chunk_data, _ in to_index:
+                chunk_data = self.backend.drop_near_duplicates(chunk_data, filename, self.department, self.category)
+                deduplicated.append(filename)
+                self.backend.assign_corpus_keywords(chunk_data, filename)
+                ids.extend(chunk['embedding_id'] for chunk in chunk_data)
+                documents.extend(chunk['chunk_text'] for chunk in chunk_data)
+                metadatas.extend(self.backend.build_chunk_metadatas(
+                    chunk_data, filename, self.department, self.category, doc_ids.get(file_path)
+                ))
+            if self.collection and ids:
+                embeddings = self.embedder.embed(documents) if self.embedder else None
+                self.collection.upsert(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings)
+                if self.lexical_index:
+                    self.lexical_index.add(ids, documents)
+
+            # 3. Journal spreadsheets also feed the publication date index
+            for file_path, filename, _, _, _, _ in to_index:
+                if self.backend.is_publication_sheet(filename):
+                    self.backend.publication_index.add_file(filename, file_path)
+
+            if cur:
+                cur.close()
+                self.db.commit()
+        except Exception:
+            # Later files may have been deduplicated against earlier ones, so undo in reverse
+            for filename in reversed(deduplicated):
+                self.backend.near_duplicate_index.rollback(filename)
+            raise
+        self.backend.near_duplicate_index.commit(*deduplicated)
+        self.indexed_hashes.update(batch_hashes)
+
+        # 4. Checkpoint only after everything above has been written
+        for file_path, _, content_hash, _, chunk_data, _ in batch:
+            self.manifest.mark_done(file_path, sha256=content_hash, doc_id=doc_ids.get(file_path),
+                                    chunks=0 if file_path in duplicate_of else len(chunk_data),
+                                    duplicate_of=duplicate_of.get(file_path))
+        self.manifest.save()
+
+        self.files_written += len(batch) - len(duplicate_of)
+        self.files_linked += len(duplicate_of)
+        self.chunks_written += len(ids)
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory of documents into the RAG index.")
+    parser.add_argument("directory", help="Directory to walk for .pdf, .docx, .xlsx and .txt files")
+    parser.add_argument("--department", required=True)
+    parser.add_argument("--category", required=True)
+    parser.add_argument("--uploaded-by", default="admin",
+                        help="Existing username recorded as the uploader (default: admin)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Extraction processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=512,
+                        help="Chunks embedded and written per batch")
+    parser.add_argument("--manifest", default=None,
+                        help="Checkpoint file (default: <directory>/.bulk_ingest_manifest.json)")
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.directory)
+    manifest = Manifest(args.manifest or os.path.join(directory, ".bulk_ingest_manifest.json"))
+    files = find_files(directory)
+    todo = [p for p in files if not manifest.is_done(p)]
+    print(f"{len(files)} files found, {len(files) - len(todo)} already ingested, {len(todo)} to go.")
+    if not todo:
+        return
+
+    # Taken before the backend module loads any index file, so nothing stale is read
+    index_lock = IndexLock()
+    if not index_lock.acquire():
+        print(f"Error: Index files are locked by process {index_lock.holder()}. "
+              "Stop the backend before running a bulk ingest.")
+        return 1
+    try:
+        return ingest(args, directory, todo, manifest)
+    finally:
+        index_lock.release()
+
+def ingest(args, directory: str, todo: List[str], manifest: Manifest):
+    """Extract, write and checkpoint the given files; the caller holds the index lock."""
+    # Imported here so extraction worker processes do not load the web app
+    import psycopg
+    import backend_complete as backend
+    from lexical_index import BM25Index
+
+    collection = None
+    lexical_index = None
+    embedder = None
+    if not backend.SKIP_EMBEDDINGS:
+        import chromadb
+        from advanced_retrieval import retriever
+        collection = chromadb.PersistentClient(path=backend.CHROMA_DB_DIR).get_or_create_collection(name="documents")
+        lexical_index = BM25Index(backend.LEXICAL_INDEX_PATH)
+        embedder = backend.create_embedder(retriever)
+
+    db = None
+    try:
+        db = psycopg.connect(
+            f"dbname='{backend.DB_NAME}' user='{backend.DB_USER}' password='{backend.DB_PASSWORD}' "
+            f"host='{backend.DB_HOST}' port='{backend.DB_PORT}'"
+        )
+    except psycopg.OperationalError as e:
+        print(f"Warning: Database unavailable, documents will not be recorded: {e}")
+
+    # documents.uploaded_by references users(username); an unknown name would fail every batch
+    if db:
+        with db.cursor() as cur:
+            cur.execute("SELECT 1 FROM users WHERE username = %s", (args.uploaded_by,))
+            user_exists = cur.fetchone() is not None
+        if not user_exists:
+            print(f"Error: User '{args.uploaded_by}' does not exist. Pass an existing username with --uploaded-by.")
+            db.close()
+            return 1
+
+    writer = BulkWriter(backend, collection, lexical_index, embedder, db, manifest,
+                        args.department, args.category, args.uploaded_by, args.batch_size)
+    start = time.monotonic()
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_extraction_worker,
+                                 initargs=(args.workers,)) as pool:
+            futures = {pool.submit(extract_file, p, source_name(p, directory)): p for p in todo}
+            for future in as_completed(futures):
+                try:
+                    writer.add(future.result())
+                except Exception as e:
+                    failed += 1
+                    print(f"Warning: Failed to ingest {futures[future]}: {e}")
+        writer.flush()
+    finally:
+        if lexical_index:
+            lexical_index.flush()
+        backend.near_duplicate_index.flush()
+        backend.keyword_index.flush()
+        if db:
+            db.close()
+
+    failed += writer.files_failed
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"Ingested {writer.files_written} files ({writer.chunks_written} chunks) in {elapsed:.1f}s: "
+          f"{writer.files_written / elapsed:.2f} files/sec, {writer.chunks_written / elapsed:.1f} chunks/sec"
+          + (f", {writer.files_linked} linked as duplicates" if writer.files_linked else "")
+          + (f", {failed} failed" if failed else ""))
+    if writer.files_written:
+        print("Restart the backend (or wait for ANSWER_CACHE_TTL) so cached answers pick up the new documents.")
+
+if __name__ == "__main__":
+    sys.exit(main())
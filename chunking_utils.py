@@ -1,4 +1,7 @@
 import re
+import copy
+import bisect
+import heapq
 import hashlib
 from typing import List, Dict, Any, Tuple, Optional
 from collections import defaultdict
@@ -6,8 +9,9 @@ import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 import nltk
 from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
+
+from near_duplicates import MinHashLSH
+from keyword_index import english_stop_words, extract_terms
 
 # Download required NLTK data
 try:
@@ -25,6 +29,13 @@ try:
 except LookupError:
     nltk.download('wordnet')
 
+# Chunk sizes per granularity: detailed for specific questions, summary for overviews
+CHUNK_LEVELS = {
+    'detailed': {'size': 200, 'overlap': 30},
+    'standard': {'size': 300, 'overlap': 50},
+    'summary': {'size': 500, 'overlap': 80}
+}
+
 class AdvancedChunkingUtils:
     """Advanced chunking utilities for RAG systems with semantic chunking, deduplication, and quality filtering."""
 
@@ -38,8 +49,7 @@ class AdvancedChunkingUtils:
         """
         self.chunk_size = chunk_size
         self.overlap = overlap
-        self.lemmatizer = WordNetLemmatizer()
-        self.stop_words = set(stopwords.words('english'))
+        self.stop_words = english_stop_words()
 
     def preprocess_text(self, text: str) -> str:
         """
@@ -109,31 +119,37 @@ class AdvancedChunkingUtils:
         else:
             return 2
 
-    def extract_keywords(self, text: str, max_keywords: int = 10) -> List[str]:
+    def extract_keywords(self, text: str, max_keywords: int = 10,
+                         tokens: Optional[List[str]] = None,
+                         terms: Optional[List[str]] = None) -> List[str]:
         """
-        Extract important keywords from text using TF-IDF like scoring.
+        Extract keywords from text by in-chunk term frequency.
+        This is the document-local fallback; once a chunk is stored, its keywords
+        are re-ranked by TF-IDF against corpus statistics (see keyword_index).
 
         Args:
             text: Input text
             max_keywords: Maximum number of keywords to extract
+            tokens: Lowercased word tokens of text, if already tokenized
+            terms: Lemmatized terms of text, if already extracted
 
         Returns:
             List of keywords
         """
-        words = word_tokenize(text.lower())
-        words = [w for w in words if w.isalnum() and w not in self.stop_words and len(w) > 2]
+        if terms is None:
+            terms = extract_terms(tokens if tokens is not None else word_tokenize(text.lower()))
 
-        # Simple frequency-based keyword extraction
         word_freq = defaultdict(int)
-        for word in words:
-            lemma = self.lemmatizer.lemmatize(word)
-            word_freq[lemma] += 1
+        for term in terms:
+            word_freq[term] += 1
 
         # Sort by frequency and return top keywords
         sorted_keywords = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)
         return [word for word, freq in sorted_keywords[:max_keywords]]
 
-    def calculate_chunk_quality_score(self, chunk_text: str, position: int, total_chunks: int) -> float:
+    def calculate_chunk_quality_score(self, chunk_text: str, position: int, total_chunks: int,
+                                      sentences: Optional[List[str]] = None,
+                                      tokens: Optional[List[str]] = None) -> float:
         """
         Calculate a quality score for a chunk based on various factors.
 
@@ -141,6 +157,8 @@ class AdvancedChunkingUtils:
             chunk_text: The chunk text
             position: Position of chunk in document (0-based)
             total_chunks: Total number of chunks
+            sentences: Sentences of chunk_text, if already split
+            tokens: Lowercased word tokens of chunk_text, if already tokenized
 
         Returns:
             Quality score between 0 and 1
@@ -156,7 +174,8 @@ class AdvancedChunkingUtils:
         score += length_score * 0.3
 
         # Completeness score (prefer chunks that start/end with complete sentences)
-        sentences = sent_tokenize(chunk_text)
+        if sentences is None:
+            sentences = sent_tokenize(chunk_text)
         if sentences:
             first_complete = sentences[0].strip().endswith(('.', '!', '?'))
             last_complete = sentences[-1].strip().endswith(('.', '!', '?'))
@@ -169,27 +188,50 @@ class AdvancedChunkingUtils:
             score += position_score * 0.2
 
         # Information density (prefer chunks with more unique words)
-        words = set(word_tokenize(chunk_text.lower()))
+        words = set(tokens if tokens is not None else word_tokenize(chunk_text.lower()))
         unique_ratio = len(words) / max(1, word_count)
         score += min(unique_ratio, 1.0) * 0.2
 
         return min(score, 1.0)
 
-    def create_semantic_chunks(self, text: str, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    def create_semantic_chunks(self, text: str, document_id: Optional[str] = None,
+                               page_offsets: Optional[List[int]] = None) -> List[Dict[str, Any]]:
         """
         Create semantic chunks with overlapping windows and enhanced metadata.
 
         Args:
             text: Input text to chunk
             document_id: Optional document ID for metadata
+            page_offsets: Optional character offset of each page start in text;
+                when given, chunks record the 1-based pages they span
 
         Returns:
             List of chunk dictionaries with metadata
         """
+        segmented = self.segment_document(text, page_offsets)
+        if not segmented:
+            return []
+        return self.chunks_from_segments(segmented, document_id)
+
+    def segment_document(self, text: str, page_offsets: Optional[List[int]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Preprocess, annotate and tokenize a document once, for any number of chunkings.
+
+        Args:
+            text: Input text
+            page_offsets: Optional character offset of each page start in text
+
+        Returns:
+            Dictionary with the structure, header index, sentences, per-sentence tokens,
+            token prefix sums and sentence pages, or None if the text has no sentences
+        """
+        # Page starts are mapped into the preprocessed text before it replaces the raw one
+        page_starts = self._normalized_page_starts(text, page_offsets) if page_offsets else None
+
         # Preprocess text
         text = self.preprocess_text(text)
         if not text:
-            return []
+            return None
 
         # Extract structural information
         structure = self.extract_text_structure(text)
@@ -197,156 +239,220 @@ class AdvancedChunkingUtils:
         # Tokenize into sentences for semantic chunking
         sentences = sent_tokenize(text)
         if not sentences:
-            return []
+            return None
+
+        # Page of every sentence, located by scanning forward through the text
+        sentence_pages = []
+        if page_starts:
+            cursor = 0
+            for sentence in sentences:
+                found = text.find(sentence, cursor)
+                if found >= 0:
+                    cursor = found
+                sentence_pages.append(bisect.bisect_right(page_starts, cursor))
+
+        # Tokenize every sentence exactly once; chunk sizes come from prefix sums over the counts
+        sentence_tokens = [word_tokenize(sentence) for sentence in sentences]
+        prefix = [0]
+        for tokens in sentence_tokens:
+            prefix.append(prefix[-1] + len(tokens))
 
-        chunks = []
-        current_chunk = []
-        current_token_count = 0
-        chunk_index = 0
+        return {
+            'structure': structure,
+            'header_index': self.build_header_index(structure),
+            'sentences': sentences,
+            'sentence_tokens': sentence_tokens,
+            'prefix': prefix,
+            'sentence_pages': sentence_pages
+        }
 
-        i = 0
-        while i < len(sentences):
-            sentence = sentences[i]
-            sentence_tokens = len(word_tokenize(sentence))
+    def chunks_from_segments(self, segmented: Dict[str, Any], document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Chunk a segmented document with this instance's chunk size and overlap.
+
+        Args:
+            segmented: Output of segment_document
+            document_id: Optional document ID for metadata
 
+        Returns:
+            List of chunk dictionaries with metadata
+        """
+        sentences = segmented['sentences']
+        sentence_tokens = segmented['sentence_tokens']
+        sentence_pages = segmented['sentence_pages']
+        prefix = segmented['prefix']
+
+        # Chunks are half-open sentence ranges [start, end)
+        ranges = []
+        start = 0
+        for i in range(len(sentences)):
             # Check if adding this sentence would exceed chunk size
-            if current_token_count + sentence_tokens > self.chunk_size and current_chunk:
-                # Create chunk from current sentences
-                chunk_text = ' '.join(current_chunk)
-                chunk_metadata = self._create_chunk_metadata(
-                    chunk_text, chunk_index, structure, len(sentences), document_id
-                )
-                chunks.append(chunk_metadata)
-
-                # Start new chunk with overlap
-                overlap_sentences = self._get_overlap_sentences(current_chunk, self.overlap)
-                current_chunk = overlap_sentences + [sentence]
-                current_token_count = sum(len(word_tokenize(s)) for s in current_chunk)
-                chunk_index += 1
-            else:
-                current_chunk.append(sentence)
-                current_token_count += sentence_tokens
-
-            i += 1
+            if prefix[i + 1] - prefix[start] > self.chunk_size and i > start:
+                ranges.append((start, i))
+                # Overlap: the longest run of trailing sentences within the overlap budget
+                start = bisect.bisect_left(prefix, prefix[i] - self.overlap, start, i + 1)
 
         # Add remaining sentences as final chunk
-        if current_chunk:
-            chunk_text = ' '.join(current_chunk)
+        ranges.append((start, len(sentences)))
+
+        chunks = []
+        for chunk_index, (first, last) in enumerate(ranges):
+            chunk_sentences = sentences[first:last]
             chunk_metadata = self._create_chunk_metadata(
-                chunk_text, chunk_index, structure, len(sentences), document_id
+                ' '.join(chunk_sentences), chunk_index, segmented['structure'], len(sentences), document_id,
+                page_range=(sentence_pages[first], sentence_pages[last - 1]) if sentence_pages else None,
+                sentences=chunk_sentences,
+                tokens=[t for tokens in sentence_tokens[first:last] for t in tokens],
+                header_index=segmented['header_index']
             )
+            # Sentence span in the shared segmentation, so chunks of different levels can be related
+            chunk_metadata['metadata']['sentence_start'] = first
+            chunk_metadata['metadata']['sentence_end'] = last
             chunks.append(chunk_metadata)
 
         return chunks
 
-    def _get_overlap_sentences(self, sentences: List[str], target_overlap_tokens: int) -> List[str]:
-        """Get sentences for overlap that total approximately target_overlap_tokens."""
-        overlap_sentences = []
-        token_count = 0
-
-        for sentence in reversed(sentences):
-            sentence_tokens = len(word_tokenize(sentence))
-            if token_count + sentence_tokens <= target_overlap_tokens:
-                overlap_sentences.insert(0, sentence)
-                token_count += sentence_tokens
-            else:
-                break
-
-        return overlap_sentences
+    def _normalized_page_starts(self, text: str, page_offsets: List[int]) -> List[int]:
+        """
+        Translate page start offsets in raw text into offsets in the preprocessed text.
+        Preprocessing collapses whitespace runs to single spaces, so preprocessing each
+        page on its own and joining the non-empty ones with a space reproduces it exactly.
+        """
+        bounds = list(page_offsets) + [len(text)]
+        starts = []
+        position = 0
+        for start, end in zip(bounds, bounds[1:]):
+            starts.append(position)
+            page = self.preprocess_text(text[start:end])
+            if page:
+                position += len(page) + 1
+        return starts
 
     def _create_chunk_metadata(self, chunk_text: str, chunk_index: int,
                               structure: Dict, total_sentences: int,
-                              document_id: Optional[str] = None) -> Dict[str, Any]:
-        """Create comprehensive metadata for a chunk."""
+                              document_id: Optional[str] = None,
+                              page_range: Optional[Tuple[int, int]] = None,
+                              sentences: Optional[List[str]] = None,
+                              tokens: Optional[List[str]] = None,
+                              header_index: Optional[Dict[str, List[int]]] = None) -> Dict[str, Any]:
+        """
+        Create comprehensive metadata for a chunk.
+        sentences and tokens are the chunker's existing tokenization of chunk_text;
+        when given, no metadata step tokenizes the text again.
+        """
+        if sentences is None:
+            sentences = sent_tokenize(chunk_text)
+        if tokens is None:
+            tokens = word_tokenize(chunk_text)
+        lower_tokens = [t.lower() for t in tokens]
+
         # Calculate quality score
         quality_score = self.calculate_chunk_quality_score(chunk_text, chunk_index,
-                                                         max(1, chunk_index + 1))
+                                                         max(1, chunk_index + 1),
+                                                         sentences=sentences, tokens=lower_tokens)
 
-        # Extract keywords
-        keywords = self.extract_keywords(chunk_text)
+        # Extract keywords (terms are kept so corpus TF-IDF can re-rank them without re-tokenizing)
+        terms = extract_terms(lower_tokens)
+        keywords = self.extract_keywords(chunk_text, terms=terms)
 
         # Find nearby headers
-        nearby_headers = self._find_nearby_headers(chunk_text, structure)
+        nearby_headers = self._find_nearby_headers(chunk_text, structure, tokens=lower_tokens,
+                                                   header_index=header_index)
 
         # Create unique embedding ID
         embedding_id = hashlib.md5(f"{document_id}_{chunk_index}_{chunk_text[:100]}".encode()).hexdigest()
 
-        return {
+        chunk = {
             'chunk_text': chunk_text,
             'chunk_index': chunk_index,
             'embedding_id': embedding_id,
             'word_count': len(chunk_text.split()),
             'quality_score': quality_score,
             'keywords': keywords,
+            'terms': terms,
             'headers': nearby_headers,
             'metadata': {
                 'position': chunk_index,
                 'total_chunks': chunk_index + 1,  # Will be updated after all chunks created
                 'document_structure': structure,
-                'sentence_count': len(sent_tokenize(chunk_text)),
+                'sentence_count': len(sentences),
                 'has_overlap': chunk_index > 0,
                 'estimated_importance': quality_score
             }
         }
+        if page_range:
+            chunk['metadata']['page'], chunk['metadata']['page_end'] = page_range
+        return chunk
+
+    def build_header_index(self, structure: Dict) -> Dict[str, List[int]]:
+        """
+        Build an inverted index from header token to header positions, once per document.
+
+        Args:
+            structure: Output of extract_text_structure
 
-    def _find_nearby_headers(self, chunk_text: str, structure: Dict) -> List[Dict]:
+        Returns:
+            Mapping of lowercased token to indexes into structure['headers'], ascending.
+            Stop words and punctuation are left out: they occur in almost every chunk and
+            header, so their postings would make every lookup cost O(headers).
+        """
+        index = defaultdict(list)
+        for header_id, header in enumerate(structure.get('headers', [])):
+            for token in set(word_tokenize(header['text'].lower())):
+                if token in self.stop_words or not any(c.isalnum() for c in token):
+                    continue
+                index[token].append(header_id)
+        return dict(index)
+
+    def _find_nearby_headers(self, chunk_text: str, structure: Dict,
+                             tokens: Optional[List[str]] = None,
+                             header_index: Optional[Dict[str, List[int]]] = None) -> List[Dict]:
         """Find headers that are contextually relevant to this chunk."""
         headers = structure.get('headers', [])
-        chunk_lower = chunk_text.lower()
-
-        relevant_headers = []
-        for header in headers:
-            header_lower = header['text'].lower()
-            # Simple relevance check - header words appear in chunk
-            header_words = set(word_tokenize(header_lower))
-            chunk_words = set(word_tokenize(chunk_lower))
+        if not headers:
+            return []
+        if header_index is None:
+            header_index = self.build_header_index(structure)
+        chunk_words = set(tokens if tokens is not None else word_tokenize(chunk_text.lower()))
 
-            if header_words.intersection(chunk_words):
-                relevant_headers.append(header)
+        # Simple relevance check - header words appear in chunk, resolved through the index.
+        # Postings are ascending and only the first 3 headers are kept, so 3 per word suffice.
+        matches = set()
+        for word in chunk_words:
+            matches.update(header_index.get(word, ())[:3])
 
-        return relevant_headers[:3]  # Limit to top 3 relevant headers
+        # Limit to top 3 relevant headers, in document order
+        return [headers[header_id] for header_id in heapq.nsmallest(3, matches)]
 
     def deduplicate_chunks(self, chunks: List[Dict[str, Any]],
-                          similarity_threshold: float = 0.85) -> List[Dict[str, Any]]:
+                          similarity_threshold: float = 0.85,
+                          index: Optional[MinHashLSH] = None,
+                          group: str = "", scope: str = "") -> List[Dict[str, Any]]:
         """
         Remove duplicate or highly similar chunks.
 
         Args:
             chunks: List of chunk dictionaries
             similarity_threshold: Threshold for considering chunks duplicates (0-1)
+            index: Persistent MinHash/LSH index to deduplicate against the whole corpus
+                (its own threshold applies); by default only these chunks are compared.
+                The caller commits or rolls back the group once the chunks are stored
+            group: Source document of the chunks, so re-ingesting replaces its old entries
+            scope: Only chunks indexed under the same scope count as duplicates
 
         Returns:
             Deduplicated list of chunks
         """
-        if len(chunks) <= 1:
+        if len(chunks) <= 1 and index is None:
             return chunks
 
-        # Simple deduplication based on text similarity (can be enhanced with embeddings)
-        unique_chunks = []
-        seen_texts = set()
-
-        for chunk in chunks:
-            chunk_text = chunk['chunk_text'].strip().lower()
-            # Create a simplified version for comparison
-            simplified = re.sub(r'[^\w\s]', '', chunk_text)
-            simplified = ' '.join(simplified.split()[:50])  # First 50 words
-
-            is_duplicate = False
-            for seen_text in seen_texts:
-                # Simple Jaccard similarity
-                set1 = set(simplified.split())
-                set2 = set(seen_text.split())
-                intersection = len(set1.intersection(set2))
-                union = len(set1.union(set2))
-                if union > 0 and intersection / union > similarity_threshold:
-                    is_duplicate = True
-                    break
-
-            if not is_duplicate:
-                unique_chunks.append(chunk)
-                seen_texts.add(simplified)
-
-        return unique_chunks
+        # MinHash/LSH over word sets: near-linear instead of pairwise Jaccard
+        # An empty persistent index is falsy (it defines __len__), so test for None explicitly
+        if index is None:
+            index = MinHashLSH(threshold=similarity_threshold)
+        keys = [chunk.get('embedding_id') or f"{group}_{i}" for i, chunk in enumerate(chunks)]
+        kept = set(index.deduplicate(list(zip(keys, (c['chunk_text'] for c in chunks))), group=group, scope=scope))
+        return [chunk for chunk, key in zip(chunks, keys) if key in kept]
 
     def filter_low_quality_chunks(self, chunks: List[Dict[str, Any]],
                                 quality_threshold: float = 0.3) -> List[Dict[str, Any]]:
@@ -373,21 +479,48 @@ class AdvancedChunkingUtils:
         Returns:
             Dictionary with different levels of chunks
         """
-        # Create different chunk sizes for different use cases
-        chunk_configs = {
-            'detailed': {'size': 200, 'overlap': 30},  # For detailed queries
-            'standard': {'size': 300, 'overlap': 50},  # Standard RAG chunks
-            'summary': {'size': 500, 'overlap': 80}    # For summary/overview queries
-        }
+        return self.create_multilevel_chunks(text, document_id)
 
-        hierarchical_chunks = {}
+    def create_multilevel_chunks(self, text: str, document_id: Optional[str] = None,
+                                 page_offsets: Optional[List[int]] = None,
+                                 levels: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Chunk a document at several granularities from one shared segmentation.
+        Preprocessing, structure, sentence and word tokenization happen once; each
+        level only re-windows the shared sentence stream. Every chunk records its
+        level in metadata, and levels other than 'standard' get their own chunk ids.
+
+        Args:
+            text: Input text
+            document_id: Optional document ID
+            page_offsets: Optional character offset of each page start in text
+            levels: Names from CHUNK_LEVELS (default: all of them)
 
-        for level, config in chunk_configs.items():
-            chunker = AdvancedChunkingUtils(config['size'], config['overlap'])
-            chunks = chunker.create_semantic_chunks(text, document_id)
+        Returns:
+            Dictionary of level name to deduplicated, quality-filtered chunks
+        """
+        levels = levels or list(CHUNK_LEVELS)
+        unknown = [level for level in levels if level not in CHUNK_LEVELS]
+        if unknown:
+            raise ValueError(f"Unknown chunk levels {unknown}: expected names from {list(CHUNK_LEVELS)}")
+        segmented = self.segment_document(text, page_offsets)
+
+        hierarchical_chunks = {}
+        for level in levels:
+            if not segmented:
+                hierarchical_chunks[level] = []
+                continue
+            # Shallow copy: same NLTK resources, different window
+            chunker = copy.copy(self)
+            chunker.chunk_size = CHUNK_LEVELS[level]['size']
+            chunker.overlap = CHUNK_LEVELS[level]['overlap']
+            level_id = document_id if level == 'standard' else f"{document_id}#{level}"
+            chunks = chunker.chunks_from_segments(segmented, level_id)
+            for chunk in chunks:
+                chunk['metadata']['level'] = level
             chunks = chunker.deduplicate_chunks(chunks)
             chunks = chunker.filter_low_quality_chunks(chunks)
-            hierarchical_chunks[level] = chunks
+            hierarchical_chunks[level] = chunker.prepare_chunks_for_embedding(chunks)
 
         return hierarchical_chunks
 
@@ -415,12 +548,20 @@ class AdvancedChunkingUtils:
 
 
 # Convenience functions for backward compatibility
-def create_semantic_chunks(text: str, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+def create_semantic_chunks(text: str, document_id: Optional[str] = None,
+                           page_offsets: Optional[List[int]] = None) -> List[Dict[str, Any]]:
     """Create semantic chunks with default settings."""
     chunker = AdvancedChunkingUtils()
-    chunks = chunker.create_semantic_chunks(text, document_id)
+    chunks = chunker.create_semantic_chunks(text, document_id, page_offsets)
     return chunker.prepare_chunks_for_embedding(chunks)
 
+def create_multilevel_chunks(text: str, document_id: Optional[str] = None,
+                             page_offsets: Optional[List[int]] = None,
+                             levels: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Create chunks at several granularities with default settings."""
+    chunker = AdvancedChunkingUtils()
+    return chunker.create_multilevel_chunks(text, document_id, page_offsets, levels)
+
 def deduplicate_chunks(chunks: List[Dict[str, Any]], threshold: float = 0.85) -> List[Dict[str, Any]]:
     """Deduplicate chunks with default settings."""
     chunker = AdvancedChunkingUtils()
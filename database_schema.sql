@@ -193,7 +193,7 @@ CREATE INDEX idx_patents_department ON patents(department);
 CREATE INDEX idx_patents_status ON patents(status);
 
 -- Create full-text search indexes
-CREATE INDEX idx_documents_metadata_gin ON documents USING gin(metadata);
+CREATE INDEX idx_documents_metadata_gin ON documents USING gin(metadata); -- also serves content_hash / duplicate_of lookups
 CREATE INDEX idx_documents_keywords_gin ON documents USING gin(keywords);
 
 -- Create trigger for updated_at
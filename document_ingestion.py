@@ -0,0 +1,488 @@
+"""
+Document Ingestion for RAG System
+Text extraction and chunking that can run in worker processes, plus a durable
+on-disk job queue so uploads are acknowledged immediately and survive restarts.
+"""
+
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+
+from openpyxl import load_workbook
+import PyPDF2
+import docx
+
+logger = logging.getLogger(__name__)
+
+QUALITY_THRESHOLD = 0.3
+HASH_BLOCK_BYTES = 1024 * 1024
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".xlsx", ".txt")
+
+# Smaller PDFs are not worth the cost of re-parsing the file in several processes
+PDF_PARALLEL_MIN_PAGES = 32
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+# Size of the process pool this process belongs to (1 outside a pool); see init_extraction_worker
+_outer_workers = 1
+
+# Spreadsheets are chunked as records: a few rows per chunk, capped in size
+XLSX_ROWS_PER_CHUNK = int(os.getenv("XLSX_ROWS_PER_CHUNK", "3"))
+XLSX_MAX_CHUNK_CHARS = 1000
+XLSX_RECORD_QUALITY = 0.7
+
+# Granularity names, matching chunking_utils.CHUNK_LEVELS (not imported here: it loads NLTK)
+CHUNK_LEVEL_NAMES = ("detailed", "standard", "summary")
+
+def configured_chunk_levels(value: str) -> List[str]:
+    """
+    Parse the CHUNK_LEVELS setting. Unknown names are ignored with a warning, and
+    'standard' is always kept: dedup, keyword statistics, spreadsheet records and
+    migrated chunks all live at that level, and queries fall back to it.
+    """
+    levels = []
+    for level in (l.strip() for l in value.split(",")):
+        if not level:
+            continue
+        if level not in CHUNK_LEVEL_NAMES:
+            print(f"Warning: Ignoring unknown chunk level '{level}' (expected {', '.join(CHUNK_LEVEL_NAMES)})")
+        elif level not in levels:
+            levels.append(level)
+    if "standard" not in levels:
+        print("Warning: CHUNK_LEVELS must include 'standard'; adding it")
+        levels.append("standard")
+    return levels
+
+# Granularities stored per document (see chunking_utils.CHUNK_LEVELS)
+INGEST_CHUNK_LEVELS = configured_chunk_levels(os.getenv("CHUNK_LEVELS", "detailed,standard,summary"))
+
+# Job lifecycle: queued -> extracting -> embedding -> completed | failed
+JOB_FINISHED_STATES = ("completed", "failed")
+# Finished job records are kept this long for clients polling their status, then deleted
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_HOURS", "168")) * 3600
+
+# --- File Processing ---
+def init_extraction_worker(outer_workers: int):
+    """
+    Process pool initializer for file extraction workers. Each worker then splits
+    PDFs over only its share of the cores, instead of every worker starting a
+    page pool as large as the machine.
+    """
+    global _outer_workers
+    _outer_workers = max(1, outer_workers)
+
+def pdf_worker_budget() -> int:
+    """Page-range processes one PDF may use from this process."""
+    return min(PDF_EXTRACT_WORKERS, max(1, (os.cpu_count() or 1) // _outer_workers))
+
+def extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) of a PDF, one string per page."""
+    with open(file_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def extract_pdf_pages(file_path: str, max_workers: Optional[int] = None) -> List[str]:
+    """
+    Extract a PDF page by page, splitting large documents into page ranges
+    that are parsed in parallel worker processes.
+
+    Args:
+        file_path: Path to the PDF
+        max_workers: Processes to use (defaults to pdf_worker_budget())
+
+    Returns:
+        Text of every page, in page order
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            page_count = len(PyPDF2.PdfReader(f).pages)
+    except Exception as e:
+        logger.error(f"PDF extraction error: {e}")
+        return []
+
+    workers = min(max_workers or pdf_worker_budget(), page_count // (PDF_PARALLEL_MIN_PAGES // 2) or 1)
+    if page_count >= PDF_PARALLEL_MIN_PAGES and workers > 1:
+        step = -(-page_count // workers)
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        try:
+            with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+                parts = pool.map(extract_pdf_page_range, [file_path] * len(ranges),
+                                 [r[0] for r in ranges], [r[1] for r in ranges])
+                return [page for part in parts for page in part]
+        except Exception as e:
+            logger.warning(f"Parallel PDF extraction failed, falling back to serial: {e}")
+
+    try:
+        return extract_pdf_page_range(file_path, 0, page_count)
+    except Exception as e:
+        logger.error(f"PDF extraction error: {e}")
+        return []
+
+def join_pages(pages: List[str]) -> Tuple[str, List[int]]:
+    """
+    Join page texts into one document in linear time.
+
+    Returns:
+        Tuple of (text, character offset where each page starts)
+    """
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page) + 1
+    return "\n".join(pages), offsets
+
+def extract_text_from_pdf(file_path):
+    return join_pages(extract_pdf_pages(file_path))[0]
+
+def extract_text_from_docx(file_path):
+    text = ""
+    try:
+        doc = docx.Document(file_path)
+        for para in doc.paragraphs:
+            text += para.text + "\n"
+    except Exception as e:
+        logger.error(f"DOCX extraction error: {e}")
+    return text
+
+def extract_text_from_xlsx(file_path):
+    text = ""
+    try:
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        for ws in wb.worksheets:
+            text += f"\nSheet: {ws.title}\n"
+            for row in ws.iter_rows(values_only=True):
+                row_text = " ".join([str(cell) for cell in row if cell is not None])
+                text += row_text + "\n"
+        wb.close()
+    except Exception as e:
+        logger.error(f"XLSX extraction error: {e}")
+    return text
+
+def is_record_boundary(record: str, rows_per_chunk: int) -> bool:
+    """Whether a record group ends after this row; true for about one row in rows_per_chunk."""
+    return int(hashlib.md5(record.encode()).hexdigest()[:8], 16) % max(1, rows_per_chunk) == 0
+
+def format_record(columns: List[str], row: Tuple[Any, ...]) -> str:
+    """Render one spreadsheet row as 'Column: value' pairs, skipping empty cells."""
+    return "; ".join(
+        f"{columns[i] if i < len(columns) else f'Column {i + 1}'}: {str(cell).strip()}"
+        for i, cell in enumerate(row)
+        if cell is not None and str(cell).strip()
+    )
+
+def extract_spreadsheet_records(file_path: str, document_id: Optional[str] = None,
+                                rows_per_chunk: int = XLSX_ROWS_PER_CHUNK) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Stream a workbook row by row and emit record chunks keyed to each sheet's header row,
+    bypassing sentence tokenization for tabular data.
+
+    Group boundaries are content-defined: a group ends after a row whose hash falls on
+    a boundary, so inserting or deleting a row changes only the group containing it and
+    the chunks after it keep their text (and their embeddings on re-ingestion).
+
+    Args:
+        file_path: Path to the XLSX file
+        document_id: Document ID used for chunk embedding ids
+        rows_per_chunk: Average data rows per chunk
+
+    Returns:
+        Tuple of (record chunks, document structure listing each sheet's columns)
+    """
+    chunks = []
+    sheets = []
+
+    def emit(sheet: str, columns: List[str], rows: List[str], row_start: int, row_end: int):
+        chunk_text = f"Sheet: {sheet}\n" + "\n".join(rows)
+        index = len(chunks)
+        chunks.append({
+            'chunk_text': chunk_text,
+            'chunk_index': index,
+            'embedding_id': hashlib.md5(f"{document_id}_{index}_{chunk_text[:100]}".encode()).hexdigest(),
+            'word_count': len(chunk_text.split()),
+            'quality_score': XLSX_RECORD_QUALITY,
+            'keywords': [],
+            'headers': [],
+            'metadata': {
+                'position': index,
+                'level': 'standard',
+                'sheet': sheet,
+                'row_start': row_start,
+                'row_end': row_end,
+                'columns': ", ".join(columns),
+                'sentence_count': len(rows),
+                'has_overlap': False,
+                'estimated_importance': XLSX_RECORD_QUALITY
+            }
+        })
+
+    try:
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        logger.error(f"XLSX extraction error: {e}")
+        return [], {}
+
+    try:
+        for ws in wb.worksheets:
+            columns = None
+            group, group_chars, group_start, group_end = [], 0, 0, 0
+            for row_number, row in enumerate(ws.iter_rows(values_only=True), start=1):
+                if not any(cell is not None and str(cell).strip() for cell in row):
+                    continue
+                if columns is None:
+                    # First non-empty row is the header row
+                    columns = [str(c).strip() if c is not None and str(c).strip() else f"Column {i + 1}"
+                               for i, c in enumerate(row)]
+                    continue
+                record = format_record(columns, row)
+                if group and group_chars + len(record) > XLSX_MAX_CHUNK_CHARS:
+                    emit(ws.title, columns, group, group_start, group_end)
+                    group, group_chars = [], 0
+                if not group:
+                    group_start = row_number
+                group.append(record)
+                group_chars += len(record)
+                group_end = row_number
+                # Size caps only cut runs of non-boundary rows; the next boundary resynchronizes groups
+                if is_record_boundary(record, rows_per_chunk) or len(group) >= 4 * rows_per_chunk:
+                    emit(ws.title, columns, group, group_start, group_end)
+                    group, group_chars = [], 0
+            if group:
+                emit(ws.title, columns, group, group_start, group_end)
+            if columns is not None:
+                sheets.append({'name': ws.title, 'columns': columns})
+    except Exception as e:
+        logger.error(f"XLSX extraction error: {e}")
+    finally:
+        wb.close()
+
+    for chunk in chunks:
+        chunk['metadata']['total_chunks'] = len(chunks)
+    return chunks, {'sheets': sheets}
+
+def extract_text(file_path: str, filename: str) -> str:
+    """Extract plain text from an uploaded file based on its extension."""
+    if filename.endswith(".pdf"):
+        return extract_text_from_pdf(file_path)
+    if filename.endswith(".xlsx"):
+        return extract_text_from_xlsx(file_path)
+    if filename.endswith(".docx"):
+        return extract_text_from_docx(file_path)
+    if filename.endswith(".txt"):
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                return f.read()
+        except Exception as e:
+            logger.error(f"Failed to read text file {filename}: {e}")
+    return ""
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 of a file's bytes, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extract_and_chunk(file_path: str, filename: str, chunk: bool = True) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Extract and chunk one file. Runs inside a ProcessPoolExecutor worker.
+
+    Args:
+        file_path: Path to the stored upload
+        filename: Original filename, used as the document id for chunk ids
+        chunk: Whether to chunk the text (False when embeddings are disabled)
+
+    Returns:
+        Tuple of (quality-filtered chunks of every level, document structure)
+    """
+    # Spreadsheets become record chunks directly, without the sentence tokenizer
+    if filename.endswith(".xlsx"):
+        return extract_spreadsheet_records(file_path, document_id=filename) if chunk else ([], {})
+
+    page_offsets = None
+    if filename.endswith(".pdf"):
+        text, page_offsets = join_pages(extract_pdf_pages(file_path))
+    else:
+        text = extract_text(file_path, filename)
+    if not chunk or not text.strip():
+        return [], {}
+
+    # Imported here so each worker process loads NLTK once, on first use
+    from chunking_utils import create_multilevel_chunks
+
+    # Every configured granularity comes from one segmentation of the text
+    levels = create_multilevel_chunks(text, document_id=filename, page_offsets=page_offsets,
+                                      levels=INGEST_CHUNK_LEVELS)
+    chunk_data = [c for level in INGEST_CHUNK_LEVELS for c in levels[level]]
+    chunk_data = [c for c in chunk_data if c.get('quality_score', QUALITY_THRESHOLD) >= QUALITY_THRESHOLD]
+    structure = chunk_data[0]['metadata'].get('document_structure', {}) if chunk_data else {}
+    return chunk_data, structure
+
+class IngestionJobStore:
+    """
+    Durable ingestion queue: one JSON file per job, rewritten atomically on every change.
+    Unfinished jobs are also kept in memory, so resuming and duplicate lookups never scan
+    the directory; finished jobs are deleted once older than the retention period.
+    """
+
+    def __init__(self, directory: str, retention_seconds: float = JOB_RETENTION_SECONDS):
+        """
+        Initialize the job store, loading unfinished jobs and pruning expired finished ones.
+
+        Args:
+            directory: Directory holding the job files
+            retention_seconds: How long finished jobs stay readable
+        """
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Unfinished jobs by id, and (sha256, department, category) -> ids of the uploads
+        # that find_active may return, oldest first
+        self._active: Dict[str, Dict[str, Any]] = {}
+        self._by_content: Dict[Tuple[Any, Any, Any], List[str]] = {}
+        # (finished timestamp, job id) in finishing order, for pruning
+        self._finished: deque = deque()
+        self._load()
+
+    def create(self, **payload) -> Dict[str, Any]:
+        """
+        Persist a new queued job.
+
+        Args:
+            **payload: Job inputs (filename, file_path, department, ...)
+
+        Returns:
+            The stored job record
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        job = {
+            **payload,
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        with self._lock:
+            self._write(job)
+            self._track(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Load a job record, or None if it does not exist."""
+        with self._lock:
+            job = self._active.get(job_id)
+            if job is not None:
+                return dict(job)
+        return self._read(job_id)
+
+    def update(self, job_id: str, **fields) -> Optional[Dict[str, Any]]:
+        """Merge fields into a job record and persist it."""
+        with self._lock:
+            job = self._active.get(job_id)
+            job = dict(job) if job is not None else self._read(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            job['updated_at'] = datetime.now(timezone.utc).isoformat()
+            self._write(job)
+            self._track(job)
+            self._prune()
+            return dict(job)
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Jobs that have not finished, oldest first (used to resume after a restart)."""
+        with self._lock:
+            jobs = [dict(job) for job in self._active.values()]
+        return sorted(jobs, key=lambda j: j['created_at'])
+
+    def find_active(self, sha256: str, department: str, category: str) -> Optional[Dict[str, Any]]:
+        """
+        Oldest unfinished upload of the same content into the same department and category.
+        Re-ingestions and uploads already waiting on another job are never returned.
+        """
+        with self._lock:
+            job_ids = self._by_content.get((sha256, department, category))
+            return dict(self._active[job_ids[0]]) if job_ids else None
+
+    def _track(self, job: Dict[str, Any]):
+        """Bring the in-memory indexes in line with a job's current record; caller holds the lock."""
+        key = (job.get('sha256'), job.get('department'), job.get('category'))
+        job_ids = self._by_content.get(key)
+        if job_ids and job['id'] in job_ids:
+            job_ids.remove(job['id'])
+            if not job_ids:
+                del self._by_content[key]
+        if job['status'] in JOB_FINISHED_STATES:
+            self._active.pop(job['id'], None)
+            self._finished.append((self._timestamp(job), job['id']))
+            return
+        self._active[job['id']] = job
+        if not job.get('reingest') and not job.get('duplicate_of_job'):
+            job_ids = self._by_content.setdefault(key, [])
+            job_ids.append(job['id'])
+            job_ids.sort(key=lambda i: self._active[i]['created_at'])
+
+    def _prune(self):
+        """Delete finished jobs older than the retention period; caller holds the lock."""
+        cutoff = datetime.now(timezone.utc).timestamp() - self.retention_seconds
+        while self._finished and self._finished[0][0] < cutoff:
+            _, job_id = self._finished.popleft()
+            if job_id in self._active:
+                continue
+            try:
+                os.remove(self._path(job_id))
+            except OSError:
+                pass
+
+    def _load(self):
+        """Scan the job directory once at startup."""
+        for fn in os.listdir(self.directory):
+            if not fn.endswith(".json"):
+                continue
+            job = self._read(fn[:-len(".json")])
+            if job:
+                self._track(job)
+        self._finished = deque(sorted(self._finished))
+        self._prune()
+
+    @staticmethod
+    def _timestamp(job: Dict[str, Any]) -> float:
+        try:
+            return datetime.fromisoformat(job['updated_at']).timestamp()
+        except (KeyError, ValueError):
+            return 0.0
+
+    def _read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Read a job record from disk."""
+        path = self._path(job_id)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Warning: Could not read ingestion job {job_id}: {e}")
+            return None
+
+    def _path(self, job_id: str) -> Optional[str]:
+        # Job ids are uuid4 hex strings; anything else cannot name a job file
+        if not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write(self, job: Dict[str, Any]):
+        """Atomically persist a job record; caller holds the lock."""
+        path = self._path(job['id'])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
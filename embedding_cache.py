@@ -0,0 +1,118 @@
+"""
+Embedding Cache for RAG System
+Computes chunk embeddings explicitly in tuned batches and keeps every vector in
+a persistent on-disk cache keyed by a hash of the text, so identical text is
+never embedded twice.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from typing import List, Dict, Optional
+
+import numpy as np
+
+def text_hash(text: str) -> str:
+    """Cache key for a piece of text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """SQLite-backed store of float32 embeddings keyed by (model id, text hash)."""
+
+    # SQLite limits the number of bound parameters per statement
+    LOOKUP_BATCH = 500
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the cache.
+
+        Args:
+            path: SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                   model TEXT NOT NULL,
+                   text_hash TEXT NOT NULL,
+                   vector BLOB NOT NULL,
+                   PRIMARY KEY (model, text_hash)
+               )"""
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """Fetch cached vectors for the given text hashes; missing hashes are omitted."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), self.LOOKUP_BATCH):
+                batch = hashes[start:start + self.LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]):
+        """Store vectors keyed by text hash."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class BatchEmbedder:
+    """Embeds texts with a SentenceTransformer in fixed-size batches, through an EmbeddingCache."""
+
+    def __init__(self, model, model_id: str, cache: Optional[EmbeddingCache] = None, batch_size: int = 64):
+        """
+        Initialize the embedder.
+
+        Args:
+            model: Loaded SentenceTransformer
+            model_id: Identifies the model and inference backend in cache keys
+            cache: Persistent cache (None embeds every call from scratch)
+            batch_size: Texts per encode batch
+        """
+        self.model = model
+        self.model_id = model_id
+        self.cache = cache
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts as L2-normalized vectors, computing only those not cached.
+
+        Args:
+            texts: Texts to embed (duplicates are embedded once)
+
+        Returns:
+            One embedding per input text, in input order
+        """
+        hashes = [text_hash(t) for t in texts]
+        vectors = self.cache.get_many(self.model_id, list(set(hashes))) if self.cache else {}
+
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            encoded = self.model.encode(
+                list(missing.values()), batch_size=self.batch_size,
+                convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False
+            ).astype(np.float32)
+            computed = dict(zip(missing.keys(), encoded))
+            if self.cache:
+                self.cache.put_many(self.model_id, computed)
+            vectors.update(computed)
+
+        return [vectors[key].tolist() for key in hashes]
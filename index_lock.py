@@ -0,0 +1,69 @@
+"""
+Index Lock for RAG System
+Exclusive lock on the on-disk indexes (BM25, near-duplicate, keyword and
+publication indexes). Each writer keeps these in memory and rewrites the whole
+file, so only one process may own them at a time: the backend holds the lock
+for its lifetime and bulk ingestion for the length of a run.
+"""
+
+import os
+from typing import Optional, TextIO
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+INDEX_LOCK_PATH = os.path.join(os.getcwd(), "index.lock")
+
+class IndexLock:
+    """Non-blocking, process-wide file lock; released automatically if the holder dies."""
+
+    def __init__(self, path: str = INDEX_LOCK_PATH):
+        """
+        Initialize the lock.
+
+        Args:
+            path: Lock file, shared by every process that writes the indexes
+        """
+        self.path = path
+        self._file: Optional[TextIO] = None
+
+    def acquire(self) -> bool:
+        """Take the lock; returns False if another process holds it."""
+        f = open(self.path, "a+")
+        try:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def holder(self) -> Optional[str]:
+        """PID recorded by the current holder, for error messages."""
+        try:
+            with open(self.path, "r") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+        self._file = None
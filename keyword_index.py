@@ -0,0 +1,268 @@
+"""
+Keyword Statistics for RAG System
+Corpus-wide document frequencies for chunk terms, kept up to date per source
+document, so chunk keywords are ranked by TF-IDF against the whole corpus
+instead of raw in-chunk frequency.
+"""
+
+import os
+import re
+import math
+import pickle
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import List, Dict, Iterable, Optional, Set
+
+import numpy as np
+from scipy import sparse
+
+try:
+    from nltk.corpus import stopwords
+    from nltk.stem import WordNetLemmatizer
+    _lemmatizer = WordNetLemmatizer()
+except ImportError:
+    stopwords = None
+    _lemmatizer = None
+
+# Distinct words seen across a corpus are bounded in practice; this keeps the memo table small
+LEMMA_CACHE_SIZE = int(os.getenv("LEMMA_CACHE_SIZE", "100000"))
+TERM_PATTERN = re.compile(r"\w+")
+
+@lru_cache(maxsize=1)
+def english_stop_words() -> frozenset:
+    """NLTK stopword set, loaded once per process."""
+    if stopwords is None:
+        return frozenset()
+    return frozenset(stopwords.words('english'))
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize(word: str) -> str:
+    """WordNet lemma of a lowercased word, memoized across chunks and documents."""
+    if _lemmatizer is None:
+        return word
+    return _lemmatizer.lemmatize(word)
+
+def extract_terms(tokens: Iterable[str]) -> List[str]:
+    """
+    Candidate keyword terms of a chunk, in order.
+
+    Args:
+        tokens: Lowercased word tokens
+
+    Returns:
+        Lemmas of the alphanumeric, non-stopword tokens longer than two characters
+    """
+    stop_words = english_stop_words()
+    return [lemmatize(w) for w in tokens if w.isalnum() and w not in stop_words and len(w) > 2]
+
+def text_terms(text: str) -> List[str]:
+    """Keyword terms of raw text, for chunks that arrive without the chunker's tokens."""
+    return extract_terms(TERM_PATTERN.findall(text.lower()))
+
+class KeywordIndex:
+    """Document-frequency statistics of chunk terms, grouped by source document."""
+
+    def __init__(self, path: Optional[str] = None, save_delay: float = 2.0):
+        """
+        Initialize the index, loading a persisted snapshot if one exists.
+
+        Args:
+            path: File to persist the statistics to (None keeps them in memory only)
+            save_delay: Seconds to collect further updates before the snapshot is rewritten
+        """
+        self.path = path
+        self.save_delay = save_delay
+        self.doc_freq: Counter = Counter()
+        self.num_chunks = 0
+        # Per source: its own term -> chunk count contribution, so a delete can subtract it
+        self.sources: Dict[str, Counter] = {}
+        self.source_chunks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return self.num_chunks
+
+    def add_source(self, source: str, chunk_terms: List[List[str]]):
+        """
+        Count the terms of one source's chunks, replacing its previous contribution.
+
+        Args:
+            source: Source document (filename)
+            chunk_terms: Terms of each chunk, as returned by extract_terms
+        """
+        with self._lock:
+            self._add(source, chunk_terms)
+            self._schedule_save()
+
+    def remove_source(self, source: str):
+        """Subtract one source's chunks from the statistics."""
+        with self._lock:
+            if self._remove(source):
+                self._schedule_save()
+
+    def rename_source(self, source: str, new_source: str):
+        """Attribute a source's counts to another source without changing the statistics."""
+        with self._lock:
+            if source not in self.sources:
+                return
+            self._remove(new_source)
+            self.sources[new_source] = self.sources.pop(source)
+            self.source_chunks[new_source] = self.source_chunks.pop(source)
+            self._schedule_save()
+
+    def flush(self):
+        """Write pending updates to disk now (call on shutdown)."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._dirty:
+                self._save()
+
+    def idf(self, terms: List[str]) -> np.ndarray:
+        """Smoothed inverse document frequency of each term."""
+        with self._lock:
+            df = np.fromiter((self.doc_freq.get(t, 0) for t in terms), dtype=np.float32, count=len(terms))
+            n = self.num_chunks
+        return np.log((1.0 + n) / (1.0 + df)) + 1.0
+
+    def top_keywords(self, chunk_terms: List[List[str]], max_keywords: int = 10) -> List[List[str]]:
+        """
+        Rank each chunk's terms by TF-IDF against the corpus statistics.
+
+        Args:
+            chunk_terms: Terms of each chunk
+            max_keywords: Keywords to keep per chunk
+
+        Returns:
+            Keywords per chunk, highest score first
+        """
+        vocabulary: Dict[str, int] = {}
+        indptr, indices, data = [0], [], []
+        for terms in chunk_terms:
+            for term, count in Counter(terms).items():
+                indices.append(vocabulary.setdefault(term, len(vocabulary)))
+                data.append(count)
+            indptr.append(len(indices))
+        if not vocabulary:
+            return [[] for _ in chunk_terms]
+
+        terms = list(vocabulary)
+        tf = sparse.csr_matrix((np.asarray(data, dtype=np.float32), indices, indptr),
+                               shape=(len(chunk_terms), len(terms)))
+        # Column scaling by a diagonal keeps the CSR layout: row i's scores stay in indptr[i]:indptr[i+1]
+        scores = tf @ sparse.diags(self.idf(terms))
+
+        keywords = []
+        for row in range(len(chunk_terms)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            row_scores = scores.data[start:end]
+            top = np.argsort(-row_scores, kind='stable')[:max_keywords]
+            keywords.append([terms[col] for col in scores.indices[start:end][top]])
+        return keywords
+
+    def discriminative_terms(self, terms: Iterable[str], max_df_ratio: float) -> Set[str]:
+        """
+        Terms that occur in the corpus but in at most max_df_ratio of its chunks.
+
+        Args:
+            terms: Candidate terms (e.g. a query's terms)
+            max_df_ratio: Document-frequency ceiling as a fraction of all chunks
+
+        Returns:
+            The subset rare enough to narrow a candidate set
+        """
+        with self._lock:
+            ceiling = max(1, math.floor(self.num_chunks * max_df_ratio))
+            return {t for t in terms if 0 < self.doc_freq.get(t, 0) <= ceiling}
+
+    def rebuild_from_collection(self, collection, batch_size: int = 1000):
+        """Backfill the statistics from every standard-level chunk stored in a Chroma collection."""
+        by_source: Dict[str, List[List[str]]] = {}
+        offset = 0
+        while True:
+            batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch or not batch['ids']:
+                break
+            for text, meta in zip(batch['documents'], batch['metadatas']):
+                meta = meta or {}
+                if meta.get('level', 'standard') == 'standard':
+                    by_source.setdefault(meta.get('source', ''), []).append(text_terms(text))
+            offset += len(batch['ids'])
+
+        with self._lock:
+            for source, chunk_terms in by_source.items():
+                self._add(source, chunk_terms)
+            self._save()
+
+    def _add(self, source: str, chunk_terms: List[List[str]]):
+        """Replace a source's contribution; caller holds the lock."""
+        self._remove(source)
+        counts = Counter(term for terms in chunk_terms for term in set(terms))
+        self.sources[source] = counts
+        self.source_chunks[source] = len(chunk_terms)
+        self.doc_freq.update(counts)
+        self.num_chunks += len(chunk_terms)
+
+    def _remove(self, source: str) -> bool:
+        """Subtract a source's contribution; caller holds the lock."""
+        counts = self.sources.pop(source, None)
+        if counts is None:
+            return False
+        self.doc_freq.subtract(counts)
+        for term in counts:
+            if self.doc_freq[term] <= 0:
+                del self.doc_freq[term]
+        self.num_chunks -= self.source_chunks.pop(source, 0)
+        return True
+
+    def _load(self):
+        """Load the persisted statistics."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            self.sources = state['sources']
+            self.source_chunks = state['source_chunks']
+            for counts in self.sources.values():
+                self.doc_freq.update(counts)
+            self.num_chunks = sum(self.source_chunks.values())
+        except Exception as e:
+            print(f"Warning: Could not load keyword index from {self.path}: {e}")
+
+    def _schedule_save(self):
+        """
+        Mark the statistics changed and persist them once save_delay passes without a save,
+        so a burst of uploads rewrites the snapshot once rather than per document.
+        Caller holds the lock.
+        """
+        self._dirty = True
+        if not self.path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay, self._timed_save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _timed_save(self):
+        with self._lock:
+            self._save_timer = None
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        """Atomically persist the statistics; caller holds the lock."""
+        self._dirty = False
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'sources': self.sources,
+                'source_chunks': self.source_chunks
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,47 @@
+"""
+Latency Budget for RAG System
+Tracks a per-request time budget with cumulative per-stage deadlines so the
+query pipeline can degrade predictably instead of growing without bound.
+"""
+
+import time
+from typing import Dict, List, Optional
+
+class LatencyBudget:
+    """Per-request latency budget with cumulative stage deadlines."""
+
+    def __init__(self, total_ms: float, stage_deadlines_ms: Optional[Dict[str, float]] = None):
+        """
+        Start the budget clock.
+
+        Args:
+            total_ms: Overall budget for the request in milliseconds
+            stage_deadlines_ms: Deadline per stage, measured from the start of the request
+        """
+        self.start = time.monotonic()
+        self.total_ms = total_ms
+        self.stage_deadlines_ms = stage_deadlines_ms or {}
+        self.skipped: List[str] = []
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the request started."""
+        return (time.monotonic() - self.start) * 1000
+
+    def remaining_ms(self, stage: Optional[str] = None) -> float:
+        """
+        Time left before a stage's deadline, or before the overall budget runs out.
+
+        Args:
+            stage: Stage name; None means the whole request
+        """
+        deadline = min(self.stage_deadlines_ms.get(stage, self.total_ms), self.total_ms)
+        return deadline - self.elapsed_ms()
+
+    def allows(self, stage: str) -> bool:
+        """Whether the stage can still start before its deadline."""
+        return self.remaining_ms(stage) > 0
+
+    def skip(self, stage: str):
+        """Record that a stage was skipped or cut short."""
+        if stage not in self.skipped:
+            self.skipped.append(stage)
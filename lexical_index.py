@@ -0,0 +1,218 @@
+"""
+Lexical Retrieval for RAG System
+In-process BM25 inverted index over chunk text, persisted to disk and updated
+incrementally, plus reciprocal rank fusion with vector search results.
+"""
+
+import os
+import re
+import math
+import pickle
+import threading
+from collections import Counter, defaultdict
+from typing import List, Dict, Optional, Tuple
+
+# Keeps DOIs, patent numbers and dotted acronyms together as single tokens
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./\-][a-z0-9]+)*")
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in", "is",
+    "it", "of", "on", "or", "that", "the", "to", "was", "were", "with", "who", "what",
+    "when", "which", "did", "does", "do", "list", "name", "me", "about",
+}
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase and split text into index terms."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOP_WORDS]
+
+class BM25Index:
+    """Incrementally updated BM25 index keyed by Chroma chunk id."""
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75,
+                 save_delay: float = 2.0):
+        """
+        Initialize the index, loading a persisted snapshot if one exists.
+
+        Args:
+            path: File to persist the index to (None keeps it in memory only)
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalization
+            save_delay: Seconds to collect further updates before the snapshot is rewritten
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.save_delay = save_delay
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_length = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, ids: List[str], texts: List[str]):
+        """
+        Index chunk texts, replacing any existing entries with the same id.
+
+        Args:
+            ids: Chunk ids (the Chroma embedding ids)
+            texts: Chunk texts
+        """
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                self._add(chunk_id, text)
+            self._schedule_save()
+
+    def remove(self, ids: List[str]):
+        """Drop chunks from the index."""
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+            self._schedule_save()
+
+    def flush(self):
+        """Write pending updates to disk now (call on shutdown)."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._dirty:
+                self._save()
+
+    def search(self, query: str, top_k: int = 20) -> List[Tuple[str, float]]:
+        """
+        Score chunks against the query with BM25.
+
+        Args:
+            query: Search query
+            top_k: Number of results to return
+
+        Returns:
+            (chunk_id, score) pairs, best first
+        """
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if not n_docs:
+                return []
+            avg_length = self.total_length / n_docs
+
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[chunk_id] / avg_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+    def rebuild_from_collection(self, collection, batch_size: int = 1000):
+        """Backfill the index from every chunk already stored in a Chroma collection."""
+        offset = 0
+        with self._lock:
+            while True:
+                batch = collection.get(include=["documents"], limit=batch_size, offset=offset)
+                if not batch or not batch['ids']:
+                    break
+                for chunk_id, text in zip(batch['ids'], batch['documents']):
+                    self._add(chunk_id, text)
+                offset += len(batch['ids'])
+            # One snapshot for the whole backfill instead of one per batch
+            self._save()
+
+    def _add(self, chunk_id: str, text: str):
+        """Index one chunk; caller holds the lock."""
+        self._remove(chunk_id)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings[term][chunk_id] = tf
+        length = sum(terms.values())
+        self.doc_lengths[chunk_id] = length
+        self.doc_terms[chunk_id] = list(terms)
+        self.total_length += length
+
+    def _remove(self, chunk_id: str):
+        """Remove one chunk; caller holds the lock."""
+        length = self.doc_lengths.pop(chunk_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.doc_terms.pop(chunk_id, []):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(chunk_id, None)
+            if not postings:
+                del self.postings[term]
+
+    def _load(self):
+        """Load the persisted snapshot, if any."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            self.postings = defaultdict(dict, state['postings'])
+            self.doc_lengths = state['doc_lengths']
+            self.doc_terms = state['doc_terms']
+            self.total_length = state['total_length']
+        except Exception as e:
+            print(f"Warning: Could not load BM25 index from {self.path}: {e}")
+
+    def _schedule_save(self):
+        """
+        Mark the index changed and persist it once save_delay passes without a save,
+        so a burst of uploads rewrites the snapshot once rather than per call.
+        Caller holds the lock.
+        """
+        self._dirty = True
+        if not self.path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay, self._timed_save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _timed_save(self):
+        with self._lock:
+            self._save_timer = None
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        """Atomically persist the index; caller holds the lock."""
+        self._dirty = False
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'postings': dict(self.postings),
+                'doc_lengths': self.doc_lengths,
+                'doc_terms': self.doc_terms,
+                'total_length': self.total_length
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+def reciprocal_rank_fusion(ranked_lists: List[List[str]], k: int = 60) -> List[str]:
+    """
+    Merge ranked id lists with reciprocal rank fusion.
+
+    Args:
+        ranked_lists: Lists of ids, each ordered best first
+        k: RRF damping constant
+
+    Returns:
+        Fused ids, best first
+    """
+    scores: Dict[str, float] = defaultdict(float)
+    for ranked in ranked_lists:
+        for rank, item_id in enumerate(ranked):
+            scores[item_id] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,182 @@
+"""
+Asynchronous LLM Client for RAG System
+Provides a shared, connection-pooled client for Ollama and Gemini so that
+answer generation never blocks the event loop.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from typing import AsyncIterator, Optional
+
+import httpx
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+logger = logging.getLogger(__name__)
+
+class AsyncLLMClient:
+    """Non-blocking LLM client with keep-alive pooling and bounded concurrency."""
+
+    def __init__(self, provider: str = "ollama",
+                 ollama_url: str = "http://localhost:11434/api/generate",
+                 ollama_model: str = "llama3.2:3b",
+                 gemini_model: str = "gemini-1.5-flash",
+                 timeout: float = 120.0,
+                 max_connections: int = 20,
+                 max_keepalive_connections: int = 10,
+                 max_concurrency: int = 4):
+        """
+        Initialize the LLM client.
+
+        Args:
+            provider: 'ollama' or 'gemini'
+            ollama_url: Ollama generate endpoint
+            ollama_model: Ollama model name
+            gemini_model: Gemini model name
+            timeout: Read timeout for a single generation in seconds
+            max_connections: Maximum pooled HTTP connections
+            max_keepalive_connections: Maximum idle keep-alive connections
+            max_concurrency: Maximum generations in flight at once
+        """
+        self.provider = provider.lower()
+        self.ollama_url = ollama_url
+        self.ollama_tags_url = ollama_url.split("/api/")[0] + "/api/tags"
+        self.ollama_model = ollama_model
+        self.gemini_model = gemini_model
+        self.timeout = httpx.Timeout(timeout, connect=10.0)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.max_concurrency = max_concurrency
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared HTTP client, creating it on first use."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return self._client
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Return the concurrency limiter, creating it inside the running loop."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def generate(self, prompt: str) -> Optional[str]:
+        """
+        Generate a completion for the prompt.
+
+        Args:
+            prompt: Full prompt text
+
+        Returns:
+            Generated text, or None if the provider returned an error status
+        """
+        async with self._get_semaphore():
+            if self.provider == "ollama":
+                response = await self._get_client().post(self.ollama_url, json={
+                    "model": self.ollama_model,
+                    "prompt": prompt,
+                    "stream": False
+                })
+                if response.status_code == 200:
+                    return response.json().get("response", "Error generating response")
+                return None
+
+            # The Gemini SDK is synchronous, so run it in a worker thread
+            model = genai.GenerativeModel(self.gemini_model)
+            response = await asyncio.to_thread(model.generate_content, prompt)
+            return response.text
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Stream a completion for the prompt as text fragments arrive.
+
+        Args:
+            prompt: Full prompt text
+
+        Yields:
+            Text fragments in generation order
+        """
+        async with self._get_semaphore():
+            if self.provider == "ollama":
+                async with self._get_client().stream("POST", self.ollama_url, json={
+                    "model": self.ollama_model,
+                    "prompt": prompt,
+                    "stream": True
+                }) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        if data.get("response"):
+                            yield data["response"]
+                        if data.get("done"):
+                            break
+                return
+
+            # Bridge the synchronous Gemini stream iterator into the event loop
+            loop = asyncio.get_running_loop()
+            queue: asyncio.Queue = asyncio.Queue()
+            done = object()
+            model = genai.GenerativeModel(self.gemini_model)
+            stop = threading.Event()
+
+            def produce():
+                try:
+                    for chunk in model.generate_content(prompt, stream=True):
+                        if stop.is_set():
+                            break
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+                except Exception as e:
+                    loop.call_soon_threadsafe(queue.put_nowait, e)
+                finally:
+                    loop.call_soon_threadsafe(queue.put_nowait, done)
+
+            asyncio.ensure_future(asyncio.to_thread(produce))
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is done:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    if item:
+                        yield item
+            finally:
+                # Never wait for the producer here: a consumer that times out or disconnects
+                # must not be held until Gemini finishes. The thread stops at its next chunk.
+                stop.set()
+
+    async def health(self, gemini_configured: bool = True) -> bool:
+        """Check that the configured provider is reachable without blocking the loop."""
+        if self.provider == "ollama":
+            try:
+                response = await self._get_client().get(self.ollama_tags_url, timeout=5.0)
+                return response.status_code == 200
+            except Exception:
+                return False
+
+        if not gemini_configured or genai is None:
+            return False
+        try:
+            model = genai.GenerativeModel(self.gemini_model)
+            await asyncio.to_thread(model.generate_content, "Ping")
+            return True
+        except Exception as e:
+            logger.error(f"Gemini Health Check Failed: {e}")
+            return False
+
+    async def aclose(self):
+        """Close pooled connections."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
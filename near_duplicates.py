@@ -0,0 +1,404 @@
+"""
+Near-Duplicate Detection for RAG System
+MinHash signatures with banded locality-sensitive hashing, so each chunk is
+checked against the whole corpus in roughly constant time instead of being
+compared pairwise. The index is persisted and updated per document.
+
+Chunks are only matched within a scope (department/category), so a dropped
+duplicate stays retrievable under the same filters as its canonical copy. The
+index remembers which groups rely on another group's chunks, so deleting or
+changing the canonical copy reports those groups for re-ingestion.
+"""
+
+import os
+import re
+import zlib
+import pickle
+import threading
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+import numpy as np
+
+# Hash family h(x) = (a * x + b) mod p over 32-bit shingle hashes; a * x stays below 2^63
+MERSENNE_PRIME = (1 << 31) - 1
+SHINGLE_PATTERN = re.compile(r"\w+")
+
+def shingles(text: str) -> Set[str]:
+    """Word set of a text, matching the word-level Jaccard used for chunk dedup."""
+    return set(SHINGLE_PATTERN.findall(text.lower()))
+
+def dedup_scope(department: Optional[str], category: Optional[str]) -> str:
+    """Scope within which chunks may be deduplicated against each other."""
+    return f"{department or ''}/{category or ''}"
+
+class MinHashLSH:
+    """MinHash + LSH index of text signatures, grouped by source document."""
+
+    def __init__(self, bands: int = 16, rows: int = 8, threshold: float = 0.85,
+                 path: Optional[str] = None, seed: int = 1, save_delay: float = 2.0):
+        """
+        Initialize the index, loading a persisted snapshot if one exists.
+
+        Args:
+            bands: LSH bands; more bands catch lower similarities
+            rows: Signature rows per band; more rows make buckets stricter
+            threshold: Minimum estimated Jaccard similarity to call a duplicate
+            path: File to persist the index to (None keeps it in memory only)
+            seed: Seed for the hash permutations (must stay fixed for a persisted index)
+            save_delay: Seconds to collect further updates before the snapshot is rewritten
+        """
+        self.bands = bands
+        self.rows = rows
+        self.num_perm = bands * rows
+        self.threshold = threshold
+        self.path = path
+        self.save_delay = save_delay
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, MERSENNE_PRIME, size=self.num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, MERSENNE_PRIME, size=self.num_perm, dtype=np.uint64)
+        self.signatures: Dict[str, np.ndarray] = {}
+        self.groups: Dict[str, str] = {}
+        # Group -> its keys, so per-document operations never scan the whole index
+        self.members: Dict[str, Set[str]] = {}
+        self.scopes: Dict[str, str] = {}
+        # Canonical key -> groups whose chunks were dropped as duplicates of it
+        self.dependants: Dict[str, Set[str]] = {}
+        # Group -> canonical keys (of other groups) its dropped chunks rely on
+        self.depends_on: Dict[str, Set[str]] = defaultdict(set)
+        # Groups that lost a canonical chunk and must be re-ingested to store their own copy
+        self.orphaned: Set[str] = set()
+        self._buckets: List[Dict[bytes, Set[str]]] = [defaultdict(set) for _ in range(bands)]
+        # Group -> state before its uncommitted deduplicate call
+        self._undo: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of a text's word set."""
+        words = shingles(text)
+        if not words:
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint32)
+        hashes = np.fromiter((zlib.crc32(w.encode("utf-8")) for w in words), dtype=np.uint64, count=len(words))
+        # One vectorized pass: every permutation applied to every shingle hash
+        permuted = (np.outer(hashes, self._a) + self._b) % np.uint64(MERSENNE_PRIME)
+        # Values are below 2^31, so the stored signature fits in 32 bits
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def query(self, sig: np.ndarray, exclude_group: Optional[str] = None,
+              scope: Optional[str] = None) -> Optional[str]:
+        """
+        Find an indexed key whose estimated similarity meets the threshold.
+
+        Args:
+            sig: MinHash signature
+            exclude_group: Ignore keys belonging to this group (e.g. the document being re-ingested)
+            scope: Only match keys in this scope (None matches any scope)
+
+        Returns:
+            Key of the most similar match, or None
+        """
+        with self._lock:
+            return self._query(sig, exclude_group, scope)
+
+    def add(self, key: str, sig: np.ndarray, group: str = "", scope: str = ""):
+        """Index a signature under a key, its source group and scope."""
+        with self._lock:
+            self._add(key, sig, group, scope)
+
+    def remove_group(self, group: str):
+        """Drop every key of one source group; groups that relied on them become orphaned."""
+        with self._lock:
+            self._undo.pop(group, None)
+            for key in self._group_keys(group):
+                self._remove(key)
+            self._release_dependencies(group)
+            self.orphaned.discard(group)
+            self._schedule_save()
+
+    def rename_group(self, group: str, new_group: str):
+        """Move every key of one source group to another (the chunks changed owner, not content)."""
+        with self._lock:
+            keys = self.members.pop(group, set())
+            for key in keys:
+                self.groups[key] = new_group
+            if keys:
+                self.members.setdefault(new_group, set()).update(keys)
+            # Every dependants entry naming the group is reachable through its depends_on keys
+            for key in self.depends_on.pop(group, set()):
+                self.depends_on[new_group].add(key)
+                dependants = self.dependants.get(key)
+                if dependants is not None:
+                    dependants.discard(group)
+                    dependants.add(new_group)
+            if group in self.orphaned:
+                self.orphaned.discard(group)
+                self.orphaned.add(new_group)
+            self._schedule_save()
+
+    def deduplicate(self, items: List[Tuple[str, str]], group: str = "", scope: str = "") -> List[str]:
+        """
+        Index a document's texts, skipping near-duplicates of each other and of other
+        groups in the same scope. Entries previously indexed for the same group are replaced.
+
+        The change is applied in memory only: call commit(group) once the kept texts are
+        stored, or rollback(group) if storing them failed, so a failed write never leaves
+        entries that suppress other documents' chunks.
+
+        Args:
+            items: (key, text) pairs
+            group: Source group of the texts
+            scope: Only texts in the same scope count as duplicates
+
+        Returns:
+            Keys that were kept, in input order
+        """
+        signatures = [(key, self.signature(text)) for key, text in items]
+        kept = []
+        with self._lock:
+            old_keys = self._group_keys(group)
+            if group not in self._undo:
+                self._undo[group] = {
+                    'entries': [(k, self.signatures[k], self.scopes.get(k, "")) for k in old_keys],
+                    'dependants': {k: set(self.dependants[k]) for k in old_keys if k in self.dependants},
+                    'depends_on': set(self.depends_on.get(group, ())),
+                    # Only this call's own orphan changes are undone, never ones made meanwhile
+                    'was_orphaned': group in self.orphaned,
+                    'orphaned_added': set()
+                }
+            # Groups relying on this group's old chunks keep relying on any chunk that is re-added
+            carried = {k: self.dependants.pop(k) for k in old_keys if k in self.dependants}
+            for key in old_keys:
+                self._remove(key)
+            self._release_dependencies(group)
+            self.orphaned.discard(group)
+
+            for key, sig in signatures:
+                match = self._query(sig, exclude_group=None, scope=scope)
+                if match is None:
+                    self._add(key, sig, group, scope)
+                    kept.append(key)
+                elif self.groups[match] != group:
+                    self.dependants.setdefault(match, set()).add(group)
+                    self.depends_on[group].add(match)
+
+            for key, dependants in carried.items():
+                if key in self.signatures:
+                    self.dependants.setdefault(key, set()).update(dependants)
+                    for dependant in dependants:
+                        self.depends_on[dependant].add(key)
+                else:
+                    self._undo[group]['orphaned_added'].update(self._orphan(key, dependants))
+        return kept
+
+    def commit(self, *groups: str):
+        """Persist the deduplicate calls of one or more groups once their kept texts are stored."""
+        with self._lock:
+            for group in groups:
+                self._undo.pop(group, None)
+            self._schedule_save()
+
+    def rollback(self, group: str):
+        """Restore the index to its state before a group's uncommitted deduplicate call."""
+        with self._lock:
+            undo = self._undo.pop(group, None)
+            if undo is None:
+                return
+            for key in self._group_keys(group):
+                self.dependants.pop(key, None)
+                self._remove(key)
+            self._release_dependencies(group)
+            for key, sig, scope in undo['entries']:
+                self._add(key, sig, group, scope)
+            for key, dependants in undo['dependants'].items():
+                self.dependants[key] = set(dependants)
+                for dependant in dependants:
+                    self.depends_on[dependant].add(key)
+            for key in undo['depends_on']:
+                if key in self.signatures:
+                    self.dependants.setdefault(key, set()).add(group)
+                    self.depends_on[group].add(key)
+            self.orphaned -= undo['orphaned_added']
+            if undo['was_orphaned']:
+                self.orphaned.add(group)
+
+    def orphaned_groups(self) -> Set[str]:
+        """Groups currently waiting to be re-ingested, without clearing them."""
+        with self._lock:
+            return set(self.orphaned)
+
+    def take_orphaned(self) -> Set[str]:
+        """Groups that lost the canonical copy of a dropped chunk; cleared once returned."""
+        with self._lock:
+            orphaned, self.orphaned = self.orphaned, set()
+            if orphaned:
+                self._schedule_save()
+            return orphaned
+
+    def flush(self):
+        """Write pending updates to disk now (call on shutdown)."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if self._dirty:
+                self._save()
+
+    def rebuild_from_collection(self, collection, batch_size: int = 1000):
+        """Backfill the index from every standard-level chunk already stored in a Chroma collection."""
+        offset = 0
+        with self._lock:
+            while True:
+                batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+                if not batch or not batch['ids']:
+                    break
+                for key, text, meta in zip(batch['ids'], batch['documents'], batch['metadatas']):
+                    meta = meta or {}
+                    # Only standard chunks are compared; other levels follow their decision by span
+                    if meta.get('level', 'standard') == 'standard':
+                        self._add(key, self.signature(text), meta.get('source', ''),
+                                  dedup_scope(meta.get('department'), meta.get('category')))
+                offset += len(batch['ids'])
+            self._save()
+
+    def _group_keys(self, group: str) -> List[str]:
+        return list(self.members.get(group, ()))
+
+    def _bands(self, sig: np.ndarray) -> List[bytes]:
+        return [sig[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def _query(self, sig: np.ndarray, exclude_group: Optional[str], scope: Optional[str]) -> Optional[str]:
+        """Find the best match; caller holds the lock."""
+        candidates = set()
+        for band, bucket_key in enumerate(self._bands(sig)):
+            candidates.update(self._buckets[band].get(bucket_key, ()))
+        best, best_score = None, self.threshold
+        for key in candidates:
+            if exclude_group is not None and self.groups.get(key) == exclude_group:
+                continue
+            if scope is not None and self.scopes.get(key, "") != scope:
+                continue
+            # Fraction of agreeing signature rows estimates the Jaccard similarity
+            score = float(np.mean(self.signatures[key] == sig))
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def _add(self, key: str, sig: np.ndarray, group: str, scope: str = ""):
+        """Index one signature; caller holds the lock."""
+        if key in self.signatures:
+            self._remove(key)
+        self.signatures[key] = sig
+        self.groups[key] = group
+        self.members.setdefault(group, set()).add(key)
+        self.scopes[key] = scope
+        for band, bucket_key in enumerate(self._bands(sig)):
+            self._buckets[band][bucket_key].add(key)
+
+    def _remove(self, key: str):
+        """Remove one key, orphaning groups that relied on it; caller holds the lock."""
+        sig = self.signatures.pop(key, None)
+        group = self.groups.pop(key, None)
+        if group is not None:
+            keys = self.members.get(group)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.members[group]
+        self.scopes.pop(key, None)
+        self._orphan(key, self.dependants.pop(key, set()))
+        if sig is None:
+            return
+        for band, bucket_key in enumerate(self._bands(sig)):
+            bucket = self._buckets[band].get(bucket_key)
+            if bucket is None:
+                continue
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band][bucket_key]
+
+    def _orphan(self, key: str, dependants: Set[str]) -> Set[str]:
+        """Mark groups that relied on a removed key; returns the newly orphaned ones. Caller holds the lock."""
+        added = dependants - self.orphaned
+        for dependant in dependants:
+            self.depends_on.get(dependant, set()).discard(key)
+            self.orphaned.add(dependant)
+        return added
+
+    def _release_dependencies(self, group: str):
+        """Forget which canonical keys a group relied on; caller holds the lock."""
+        for key in self.depends_on.pop(group, set()):
+            dependants = self.dependants.get(key)
+            if dependants is not None:
+                dependants.discard(group)
+                if not dependants:
+                    del self.dependants[key]
+
+    def _load(self):
+        """Load the persisted signatures and rebuild the LSH buckets."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+            if (state['bands'], state['rows']) != (self.bands, self.rows):
+                print(f"Warning: Near-duplicate index at {self.path} uses different bands/rows, ignoring it")
+                return
+            if 'scopes' not in state:
+                # Unscoped snapshots would match across departments; rebuild from the collection instead
+                print(f"Warning: Near-duplicate index at {self.path} predates dedup scopes, ignoring it")
+                return
+            for key, sig in state['signatures'].items():
+                self._add(key, sig, state['groups'].get(key, ""), state['scopes'].get(key, ""))
+            self.dependants = {k: set(v) for k, v in state['dependants'].items()}
+            for key, dependants in self.dependants.items():
+                for dependant in dependants:
+                    self.depends_on[dependant].add(key)
+            self.orphaned = set(state['orphaned'])
+        except Exception as e:
+            print(f"Warning: Could not load near-duplicate index from {self.path}: {e}")
+
+    def _schedule_save(self):
+        """
+        Mark the index changed and persist it once save_delay passes without a save,
+        so a burst of uploads or deletes rewrites the snapshot once rather than per document.
+        Caller holds the lock.
+        """
+        self._dirty = True
+        if not self.path or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay, self._timed_save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _timed_save(self):
+        with self._lock:
+            self._save_timer = None
+            if self._undo:
+                # A document is mid-write; wait for its commit or rollback so the snapshot is consistent
+                self._schedule_save()
+            elif self._dirty:
+                self._save()
+
+    def _save(self):
+        """Atomically persist the signatures; caller holds the lock."""
+        self._dirty = False
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'bands': self.bands,
+                'rows': self.rows,
+                'signatures': self.signatures,
+                'groups': self.groups,
+                'scopes': self.scopes,
+                'dependants': self.dependants,
+                'orphaned': self.orphaned
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
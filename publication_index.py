@@ -0,0 +1,213 @@
+"""
+Publication Date Index for RAG System
+Parses journal/conference spreadsheets once at upload into a token-indexed
+record store so publication-date queries never rescan the XLSX files.
+"""
+
+import os
+import re
+import json
+import threading
+from datetime import datetime
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Set
+
+from openpyxl import load_workbook
+
+DATE_HEADERS = {"date", "date of publication", "published on", "publication date"}
+
+ISO_DATE_PATTERN = re.compile(r"\b20\d{2}-\d{1,2}-\d{1,2}\b")
+SLASH_DATE_PATTERN = re.compile(r"\b\d{1,2}/\d{1,2}/\d{4}\b")
+MONTH_YEAR_PATTERN = re.compile(r"(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{4}", re.IGNORECASE)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def normalize_tokens(text: str) -> List[str]:
+    """Lowercase and split text into alphanumeric tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def is_publication_sheet(filename: str) -> bool:
+    """Journal/conference spreadsheets are recognised by filename."""
+    name = filename.lower()
+    return name.endswith(".xlsx") and "journal" in name
+
+def parse_date(value: str) -> Optional[str]:
+    """Parse a date string into ISO format, or None if it is not recognised."""
+    value = value.strip()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d/%m/%Y", "%B %Y", "%b %Y", "%B %d, %Y", "%b %d, %Y"):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    match = ISO_DATE_PATTERN.search(value)
+    if match:
+        try:
+            return datetime.strptime(match.group(0), "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            return None
+    return None
+
+def extract_publication_records(file_path: str) -> List[Dict[str, Any]]:
+    """
+    Read every dated row of a publication spreadsheet.
+
+    Args:
+        file_path: Path to the XLSX file
+
+    Returns:
+        Records with normalized row tokens, the raw date text and its ISO form
+    """
+    records = []
+    try:
+        wb = load_workbook(filename=file_path, read_only=True, data_only=True)
+    except Exception:
+        return records
+
+    try:
+        for ws in wb.worksheets:
+            date_idx = None
+            first = True
+            for row in ws.iter_rows(values_only=True):
+                if first:
+                    for i, c in enumerate(row):
+                        s = str(c).lower() if c is not None else ""
+                        if any(h in s for h in DATE_HEADERS):
+                            date_idx = i
+                    first = False
+
+                date_candidates = []
+                for c in row:
+                    s = str(c) if c is not None else ""
+                    # Try regex for date patterns
+                    if ISO_DATE_PATTERN.search(s) or SLASH_DATE_PATTERN.search(s) or MONTH_YEAR_PATTERN.search(s):
+                        date_candidates.append(s)
+
+                if not date_candidates and date_idx is not None:
+                    if date_idx < len(row) and row[date_idx] is not None:
+                        date_candidates.append(str(row[date_idx]))
+
+                if not date_candidates:
+                    continue
+
+                row_text = " ".join(str(c) for c in row if c is not None)
+                records.append({
+                    'sheet': ws.title,
+                    'tokens': sorted(set(normalize_tokens(row_text))),
+                    'date': date_candidates[0],
+                    'date_iso': parse_date(date_candidates[0])
+                })
+    finally:
+        wb.close()
+
+    return records
+
+class PublicationIndex:
+    """Inverted token index over publication spreadsheet rows, persisted as JSON."""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize the index, loading a persisted snapshot if one exists.
+
+        Args:
+            path: JSON file to persist records to (None keeps them in memory only)
+        """
+        self.path = path
+        self.records: Dict[str, List[Dict[str, Any]]] = {}
+        self._postings: Dict[str, Set[tuple]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return sum(len(records) for records in self.records.values())
+
+    def add_file(self, source: str, file_path: str) -> int:
+        """
+        Index a spreadsheet, replacing any records previously indexed for it.
+
+        Args:
+            source: Source filename
+            file_path: Path to the XLSX file
+
+        Returns:
+            Number of dated rows indexed
+        """
+        records = extract_publication_records(file_path)
+        with self._lock:
+            self._remove(source)
+            self.records[source] = records
+            self._index_source(source)
+            self._save()
+        return len(records)
+
+    def remove_source(self, source: str):
+        """Drop all records from one spreadsheet."""
+        with self._lock:
+            if source in self.records:
+                self._remove(source)
+                self._save()
+
+    def find_date(self, keywords: List[str]) -> Optional[str]:
+        """
+        Find the publication date of the first row containing every keyword.
+
+        Args:
+            keywords: Query keywords (author, title or journal words)
+
+        Returns:
+            Date text as it appears in the spreadsheet, or None
+        """
+        tokens = {t for k in keywords for t in normalize_tokens(k)}
+        if not tokens:
+            return None
+
+        with self._lock:
+            postings = [self._postings.get(t, set()) for t in tokens]
+            matches = set.intersection(*sorted(postings, key=len))
+            if not matches:
+                return None
+            order = {source: i for i, source in enumerate(self.records)}
+            source, row = min(matches, key=lambda m: (order[m[0]], m[1]))
+            return self.records[source][row]['date']
+
+    def rebuild_from_directory(self, directory: str):
+        """Index every publication spreadsheet found in a directory."""
+        for fn in sorted(os.listdir(directory)):
+            if is_publication_sheet(fn):
+                self.add_file(fn, os.path.join(directory, fn))
+
+    def _index_source(self, source: str):
+        """Add one source's records to the postings; caller holds the lock."""
+        for row, record in enumerate(self.records[source]):
+            for token in record['tokens']:
+                self._postings[token].add((source, row))
+
+    def _remove(self, source: str):
+        """Remove one source's records; caller holds the lock."""
+        for row, record in enumerate(self.records.pop(source, [])):
+            for token in record['tokens']:
+                entries = self._postings.get(token)
+                if entries is None:
+                    continue
+                entries.discard((source, row))
+                if not entries:
+                    del self._postings[token]
+
+    def _load(self):
+        """Load the persisted records and rebuild the postings."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.records = json.load(f)
+            for source in self.records:
+                self._index_source(source)
+        except Exception as e:
+            print(f"Warning: Could not load publication index from {self.path}: {e}")
+
+    def _save(self):
+        """Atomically persist the records; caller holds the lock."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.records, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,47 @@
+"""
+Request Coalescing for RAG System
+Lets concurrent identical requests share one in-flight computation so a burst
+of duplicate questions costs a single retrieval and LLM generation.
+"""
+
+import json
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key onto one asyncio task."""
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Build a stable key from JSON-serializable request parts."""
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn once for all concurrent callers with the same key.
+
+        Args:
+            key: Coalescing key for the request
+            fn: Coroutine factory computing the result
+
+        Returns:
+            The shared result; an exception raised by fn is re-raised to every caller
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # A caller disconnecting must not cancel the computation the others are waiting on
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        """Drop a finished task so the next request recomputes."""
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]